@@ -0,0 +1,19 @@
+import os
+import sys
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution.db import init_db, archive_terminal_leads
+
+def main():
+    print("--- Archiving Terminal Leads ---")
+    init_db()
+    
+    # Converted, disqualified and unsubscribed leads move to leads_archive / events_archive.
+    # get_lead_by_email still finds them there.
+    count = archive_terminal_leads()
+    print(f"Archive Complete. Archived: {count}")
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,13 @@
 import sqlite3
 import json
 import os
+import sys
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime
 
 try:
@@ -12,26 +19,523 @@ except ImportError:
 DB_PATH = os.path.join(os.path.dirname(__file__), '../.tmp/local_state.db')
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-def get_db_connection():
-    if DATABASE_URL:
-        if not psycopg2:
-            raise ImportError("psycopg2 is required for PostgreSQL but not installed.")
-        conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-        return conn
-    else:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
+# Max idle Postgres connections kept per process (gunicorn worker / daemon).
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+
+# Above this many rows, Postgres bulk upserts COPY into a staging table first.
+BULK_COPY_THRESHOLD = int(os.getenv("BULK_COPY_THRESHOLD", "1000"))
+
+# SQLite tuning. The daemon, gunicorn workers and Slack action threads all share one file:
+# WAL lets readers run alongside the writer, and busy_timeout makes writers wait for the
+# lock instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    'busy_timeout': int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000")),
+    'synchronous': os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    'mmap_size': int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    'cache_size': int(os.getenv("SQLITE_CACHE_SIZE", "-65536")), # negative = KiB (64 MB)
+}
+
+# In-process lead cache (get_lead_by_email / get_lead_by_id). Size 0 disables it.
+# Writes through this module invalidate it; the TTL bounds staleness from other processes.
+LEAD_CACHE_SIZE = int(os.getenv("LEAD_CACHE_SIZE", "2048"))
+LEAD_CACHE_TTL = float(os.getenv("LEAD_CACHE_TTL", "60"))
+
+# Leads moved to the archive tables per transaction.
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+
+# Rows fetched per round trip when streaming leads.
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Follow-up cadence: days to wait after the last contact before sending the next stage,
+# keyed by the stage the lead is currently at. Stage 0 is due immediately.
+FOLLOW_UP_CADENCE_DAYS = {1: 2, 2: 4, 3: 5}
+
+# Statuses that take a lead out of the sequence for good.
+TERMINAL_STATUSES = ('disqualified', 'converted', 'unsubscribed')
+
+# Inlined as literals (not bound parameters) so the planner can match the partial index below.
+ACTIVE_LEADS_SQL = "status NOT IN (" + ", ".join(f"'{s}'" for s in TERMINAL_STATUSES) + ")"
+
+# Sequence state promoted out of the metadata JSON into typed, indexed columns.
+# metadata stays the source of truth; these are kept in sync on every write.
+SEQUENCE_COLUMNS = [
+    ('sequence_stage', 'INTEGER DEFAULT 0'),
+    ('last_contacted_at', 'TIMESTAMP'),
+    ('interest', 'TEXT'),
+    ('do_not_contact', 'BOOLEAN DEFAULT FALSE'),
+    ('meeting_booked', 'BOOLEAN DEFAULT FALSE'),
+    ('has_replied', 'BOOLEAN DEFAULT FALSE'),
+    # When the next stage becomes due (NULL = never: suppressed or sequence finished)
+    ('next_due_at', 'TIMESTAMP'),
+]
+
+# next_due_at for stage 0 leads: due as soon as they are seen.
+DUE_IMMEDIATELY = '1970-01-01T00:00:00'
+
+# Secondary indexes managed by init_db: name -> (table, columns, partial WHERE or None).
+INDEXES = {
+    # Due-lead range scan, restricted to leads the sequence can still act on
+    'idx_leads_active_due': ('leads', 'next_due_at', ACTIVE_LEADS_SQL),
+    'idx_leads_stage_interest': ('leads', 'sequence_stage, interest', None),
+    'idx_leads_status': ('leads', 'status', None),
+    'idx_leads_hubspot_id': ('leads', 'hubspot_id', None),
+    'idx_events_lead_time': ('events', 'lead_id, timestamp', None),
+}
+
+# Columns of the leads table. Sequence columns are derived from metadata and read-only on Lead.
+BASE_COLUMNS = ('id', 'email', 'name', 'phone', 'source', 'status', 'hubspot_id',
+                'lead_score', 'intent', 'created_at', 'updated_at')
+DERIVED_COLUMNS = tuple(name for name, _ in SEQUENCE_COLUMNS)
+WRITABLE_COLUMNS = ('email', 'name', 'phone', 'source', 'status', 'hubspot_id', 'lead_score', 'intent')
+
+# Indexes created by earlier versions and since replaced.
+OBSOLETE_INDEXES = ['idx_leads_stage_contacted', 'idx_leads_next_due']
+
+
+class PooledConnection:
+    """
+    Thin proxy around a DB-API connection.
+    Behaves like the raw connection, except close() hands it back to the pool.
+    """
+
+    def __init__(self, conn, pool):
+        self._conn = conn
+        self._pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class PostgresPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+    Idle connections are reused instead of paying a TCP + auth handshake per call.
+    """
+
+    def __init__(self, dsn, max_idle):
+        self.dsn = dsn
+        self.max_idle = max_idle
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        # Names of server-side prepared statements, per connection (they live as long as the session)
+        self._prepared = {}
+
+    def acquire(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return psycopg2.connect(self.dsn, cursor_factory=RealDictCursor)
+            if not conn.closed:
+                return conn
+            self._prepared.pop(id(conn), None)
+
+    def release(self, conn):
+        try:
+            # Never hand out a connection with a half-finished transaction
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        if self._idle.qsize() < self.max_idle:
+            self._idle.put(conn)
+        else:
+            self._discard(conn)
+
+    def prepared_names(self, conn):
+        return self._prepared.setdefault(id(conn), set())
+
+    def _discard(self, conn):
+        self._prepared.pop(id(conn), None)
+        conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+class SQLitePool:
+    """
+    One persistent sqlite3 connection per thread (sqlite3 connections cannot be shared across threads).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self._local = threading.local()
+
+    def acquire(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=SQLITE_PRAGMAS['busy_timeout'] / 1000)
+            conn.row_factory = sqlite3.Row
+            apply_sqlite_pragmas(conn)
+            self._local.conn = conn
+            self._local.depth = 0
+        # Nested acquires on one thread share the connection; track depth so an
+        # inner release doesn't roll back the outer caller's work.
+        self._local.depth += 1
         return conn
 
+    def release(self, conn):
+        # Keep the connection open for the next call on this thread
+        self._local.depth = max(getattr(self._local, 'depth', 1) - 1, 0)
+        if self._local.depth == 0 and conn.in_transaction:
+            conn.rollback()
+
+    def close_all(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def apply_sqlite_pragmas(conn, pragmas=None):
+    """Applies SQLITE_PRAGMAS (or the given overrides) to a new sqlite3 connection."""
+    for name, value in (pragmas or SQLITE_PRAGMAS).items():
+        if value is None or value == '':
+            continue
+        if not str(value).lstrip('-').isalnum():
+            raise ValueError(f"Invalid value for PRAGMA {name}: {value!r}")
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+_MISSING = object()
+
+def _parse_metadata(raw):
+    if isinstance(raw, dict):
+        return dict(raw)
+    if not raw:
+        return {}
+    try:
+        value = json.loads(raw)
+    except (TypeError, ValueError):
+        return {}
+    return value if isinstance(value, dict) else {}
+
+
+class Lead:
+    """
+    Compact lead record built from a DB row.
+
+    Reads like the dicts the code used before (lead['email'], lead.get('metadata', {}), dict(lead)),
+    but uses __slots__ instead of a per-row dict, keeps metadata as the raw JSON string until it
+    is first accessed, and tracks changes so save_lead() only writes what actually changed.
+    """
+
+    __slots__ = BASE_COLUMNS + DERIVED_COLUMNS + ('_raw_metadata', '_metadata', '_dirty', '_extra')
+
+    def __init__(self, **fields):
+        self._raw_metadata = None
+        self._metadata = None
+        self._dirty = None # column names, allocated on first write
+        self._extra = None
+        for key, value in fields.items():
+            self._load(key, value)
+
+    @classmethod
+    def from_row(cls, row):
+        lead = cls()
+        for key in row.keys():
+            lead._load(key, row[key])
+        return lead
+
+    def _load(self, key, value):
+        if key == 'metadata':
+            if isinstance(value, dict):
+                self._metadata = dict(value)
+                value = json.dumps(value)
+            self._raw_metadata = value
+        elif key in Lead.__slots__ and not key.startswith('_'):
+            object.__setattr__(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    @property
+    def metadata(self):
+        # Decoded on first access only
+        if self._metadata is None:
+            self._metadata = _parse_metadata(self._raw_metadata)
+        return self._metadata
+
+    def __getitem__(self, key):
+        if key == 'metadata':
+            return self.metadata
+        if key in BASE_COLUMNS or key in DERIVED_COLUMNS:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                return value
+        elif self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'metadata':
+            self._metadata = dict(value)
+        elif key in DERIVED_COLUMNS:
+            raise KeyError(f"{key} is derived from metadata; set lead['metadata'][{key!r}] instead")
+        elif key in WRITABLE_COLUMNS:
+            object.__setattr__(self, key, value)
+            if self._dirty is None:
+                self._dirty = set()
+            self._dirty.add(key)
+        elif key in BASE_COLUMNS:
+            raise KeyError(f"{key} is managed by the database and can't be set")
+        else:
+            raise KeyError(f"Unknown lead column: {key}")
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [k for k in BASE_COLUMNS + DERIVED_COLUMNS if getattr(self, k, _MISSING) is not _MISSING]
+        keys.append('metadata')
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def copy(self):
+        lead = Lead()
+        for key in BASE_COLUMNS + DERIVED_COLUMNS:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                object.__setattr__(lead, key, value)
+        lead._raw_metadata = self._raw_metadata
+        lead._metadata = dict(self._metadata) if self._metadata is not None else None
+        lead._dirty = set(self._dirty) if self._dirty else None
+        lead._extra = dict(self._extra) if self._extra else None
+        return lead
+
+    def __eq__(self, other):
+        if isinstance(other, (Lead, dict)):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Lead(id={self.get('id')!r}, email={self.get('email')!r})"
+
+    def changes(self):
+        """
+        Returns (column_changes, metadata_patch) since the record was loaded or last saved.
+        metadata_patch uses None for removed keys, like patch_lead_metadata.
+        """
+        columns = {key: getattr(self, key) for key in self._dirty or ()}
+        if self._metadata is None:
+            return columns, {}
+        original = _parse_metadata(self._raw_metadata)
+        patch = {k: v for k, v in self._metadata.items() if original.get(k, _MISSING) != v}
+        patch.update({k: None for k in original if k not in self._metadata})
+        return columns, patch
+
+    def mark_clean(self):
+        self._dirty = None
+        if self._metadata is not None:
+            self._raw_metadata = json.dumps(self._metadata)
+
+
+class LeadCache:
+    """
+    Thread-safe, size-bounded LRU of decoded leads with a TTL, keyed by email (and id -> email).
+    A generation counter stops a read that raced with a write from caching the old row.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # email -> (expires_at, lead)
+        self._ids = {} # id -> email
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, email=None, lead_id=None):
+        with self._lock:
+            if email is None:
+                email = self._ids.get(lead_id)
+            entry = self._entries.get(email) if email is not None else None
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(email)
+                self.hits += 1
+                return _copy_lead(entry[1])
+            if entry:
+                self._drop(email)
+            self.misses += 1
+            return None
+
+    def put(self, lead, generation):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            email = lead['email']
+            self._entries[email] = (time.monotonic() + self.ttl, _copy_lead(lead))
+            self._entries.move_to_end(email)
+            self._ids[lead['id']] = email
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, emails=(), lead_ids=()):
+        with self._lock:
+            self._generation += 1
+            for lead_id in lead_ids:
+                email = self._ids.pop(lead_id, None)
+                if email is not None:
+                    self._entries.pop(email, None)
+            for email in emails:
+                self._drop(email)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._ids.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def _drop(self, email):
+        entry = self._entries.pop(email, None)
+        if entry:
+            self._ids.pop(entry[1]['id'], None)
+
+def _copy_lead(lead):
+    # Callers may mutate the returned record / metadata; never hand out the cached object
+    return lead.copy()
+
+lead_cache = LeadCache(LEAD_CACHE_SIZE, LEAD_CACHE_TTL)
+
+def invalidate_lead(email=None, lead_id=None):
+    """Drops a lead from the in-process cache (call after writing leads outside this module)."""
+    lead_cache.invalidate([email] if email else (), [lead_id] if lead_id is not None else ())
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Returns the process-wide pool, (re)creating it if the backend or process changed
+    (e.g. after a gunicorn fork or when DATABASE_URL / DB_PATH is reconfigured).
+    """
+    global _pool
+    with _pool_lock:
+        if DATABASE_URL:
+            if not psycopg2:
+                raise ImportError("psycopg2 is required for PostgreSQL but not installed.")
+            stale = not isinstance(_pool, PostgresPool) or _pool.dsn != DATABASE_URL
+            if stale or _pool.pid != os.getpid():
+                _pool = PostgresPool(DATABASE_URL, DB_POOL_SIZE)
+        else:
+            stale = not isinstance(_pool, SQLitePool) or _pool.path != DB_PATH
+            if stale or _pool.pid != os.getpid():
+                _pool = SQLitePool(DB_PATH)
+        return _pool
+
+def close_pool():
+    """Closes idle pooled connections (call at process shutdown)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+            _pool = None
+
+def get_db_connection():
+    """
+    Returns a pooled connection. Calling close() on it returns it to the pool.
+    """
+    pool = get_pool()
+    return PooledConnection(pool.acquire(), pool)
+
+@contextmanager
+def db_connection():
+    """
+    Context manager around a pooled connection.
+    Commits on success, rolls back on error and always returns the connection to the pool.
+
+        with db_connection() as conn:
+            execute_query(conn, "UPDATE leads SET name = ? WHERE id = ?", (name, lead_id))
+    """
+    conn = get_db_connection()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# --- Dialect layer ---
+# All SQL in this project is written SQLite-style (? placeholders, AUTOINCREMENT).
+# Translations are memoized, so the hot queries are rewritten once per process, not per call.
+
+def get_dialect():
+    return 'postgres' if DATABASE_URL else 'sqlite'
+
+@lru_cache(maxsize=1024)
+def translate_query(query, dialect):
+    """Rewrites a SQLite-style query for the given dialect."""
+    if dialect != 'postgres':
+        return query
+    # psycopg2 uses %s placeholders, so literal % must be doubled first
+    query = query.replace('%', '%%').replace('?', '%s')
+    # Postgres SERIAL vs AUTOINCREMENT
+    return query.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY')
+
+@lru_cache(maxsize=128)
+def _numbered_placeholders(query):
+    """? -> $1, $2, ... for PREPARE. Returns (query, param_count)."""
+    parts = query.split('?')
+    numbered = parts[0] + ''.join(f"${i}{part}" for i, part in enumerate(parts[1:], start=1))
+    return numbered, len(parts) - 1
+
 def execute_query(conn, query, params=()):
     cursor = conn.cursor()
     
     # Adapt placeholders
-    if DATABASE_URL:
-        # Postgres uses %s
-        query = query.replace('?', '%s')
-        # Postgres SERIAL vs AUTOINCREMENT
-        query = query.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY')
+    query = translate_query(query, get_dialect())
     
     try:
         cursor.execute(query, params)
@@ -40,61 +544,325 @@ def execute_query(conn, query, params=()):
         print(f"DB Error: {e}")
         raise e
 
+def execute_many(conn, query, seq_of_params):
+    """
+    executemany() counterpart of execute_query (same placeholder adaptation).
+    """
+    cursor = conn.cursor()
+    
+    query = translate_query(query, get_dialect())
+    
+    try:
+        cursor.executemany(query, seq_of_params)
+        return cursor
+    except Exception as e:
+        print(f"DB Error: {e}")
+        raise e
+
+def execute_prepared(conn, name, query, params=()):
+    """
+    Runs a hot query as a named prepared statement on Postgres (planned once per pooled
+    connection, then EXECUTE name(...)). SQLite already caches compiled statements per
+    connection, so there it is a plain execute_query.
+    """
+    pool = getattr(conn, '_pool', None)
+    if get_dialect() != 'postgres' or not isinstance(pool, PostgresPool):
+        return execute_query(conn, query, params)
+
+    prepared = pool.prepared_names(conn._conn)
+    numbered, count = _numbered_placeholders(query)
+    cursor = conn.cursor()
+    try:
+        if name not in prepared:
+            # Literal % must not look like a psycopg2 placeholder
+            cursor.execute(f"PREPARE {name} AS {numbered.replace('%', '%%')}", ())
+            prepared.add(name)
+        args = ', '.join(['%s'] * count)
+        cursor.execute(f"EXECUTE {name} ({args})" if count else f"EXECUTE {name}", params)
+        return cursor
+    except Exception as e:
+        print(f"DB Error: {e}")
+        raise e
+
 def init_db():
     if not DATABASE_URL:
         os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
         
-    conn = get_db_connection()
-    
-    # Leads table
-    execute_query(conn, '''
-        CREATE TABLE IF NOT EXISTS leads (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE NOT NULL,
-            name TEXT,
-            phone TEXT,
-            source TEXT,
-            status TEXT DEFAULT 'new',
-            hubspot_id TEXT,
-            lead_score INTEGER,
-            intent TEXT,
-            metadata TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    with db_connection() as conn:
+        # Leads table
+        execute_query(conn, _LEADS_DDL.format(table='leads', id_column='id INTEGER PRIMARY KEY AUTOINCREMENT', extra=''))
 
-    # Events table
-    execute_query(conn, '''
-        CREATE TABLE IF NOT EXISTS events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            lead_id INTEGER,
-            event_type TEXT NOT NULL,
-            details TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (lead_id) REFERENCES leads (id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+        # Events table
+        execute_query(conn, '''
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                lead_id INTEGER,
+                event_type TEXT NOT NULL,
+                details TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (lead_id) REFERENCES leads (id)
+            )
+        ''')
+
+        # Cold storage for terminal leads (same columns, original ids kept)
+        execute_query(conn, _LEADS_DDL.format(
+            table='leads_archive',
+            id_column='id INTEGER PRIMARY KEY',
+            extra=',\n                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP'
+        ))
+        execute_query(conn, '''
+            CREATE TABLE IF NOT EXISTS events_archive (
+                id INTEGER PRIMARY KEY,
+                lead_id INTEGER,
+                event_type TEXT NOT NULL,
+                details TEXT,
+                timestamp TIMESTAMP
+            )
+        ''')
+
+        # Small key/value store for sync watermarks and cursors (e.g. HubSpot import)
+        execute_query(conn, '''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        execute_query(conn, _RATE_LIMITS_DDL)
+        _widen_real_columns(conn, 'rate_limits', ('tokens', 'updated_at'))
+        execute_query(conn, _DAILY_QUOTAS_DDL)
+
+        # Last value we pushed to HubSpot per contact property (to skip no-op writes)
+        execute_query(conn, '''
+            CREATE TABLE IF NOT EXISTS hubspot_pushed_properties (
+                contact_id TEXT NOT NULL,
+                property TEXT NOT NULL,
+                value TEXT,
+                pushed_at DOUBLE PRECISION NOT NULL,
+                PRIMARY KEY (contact_id, property)
+            )
+        ''')
+        _widen_real_columns(conn, 'hubspot_pushed_properties', ('pushed_at',))
+
+        if DATABASE_URL:
+            execute_query(conn, _SAFE_JSONB_FUNCTION)
+
+        _migrate_sequence_columns(conn)
+        ensure_indexes(conn)
+
+_LEADS_DDL = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        {id_column},
+        email TEXT UNIQUE NOT NULL,
+        name TEXT,
+        phone TEXT,
+        source TEXT,
+        status TEXT DEFAULT 'new',
+        hubspot_id TEXT,
+        lead_score INTEGER,
+        intent TEXT,
+        metadata TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        {sequence_columns}{extra}
+    )
+'''.replace('{sequence_columns}', ',\n        '.join(f"{name} {ddl}" for name, ddl in SEQUENCE_COLUMNS))
+
+# Postgres counterpart of SQLite's json_valid guard: NULL instead of an error for bad JSON
+_SAFE_JSONB_FUNCTION = '''
+    CREATE OR REPLACE FUNCTION safe_jsonb(doc TEXT) RETURNS JSONB AS $$
+    BEGIN
+        RETURN doc::jsonb;
+    EXCEPTION WHEN others THEN
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql IMMUTABLE
+'''
+
+def _existing_columns(conn, table):
+    if DATABASE_URL:
+        cursor = execute_query(conn, "SELECT column_name FROM information_schema.columns WHERE table_name = ?", (table,))
+        return {row['column_name'] for row in cursor.fetchall()}
+    cursor = execute_query(conn, f"PRAGMA table_info({table})")
+    return {row['name'] for row in cursor.fetchall()}
+
+def _widen_real_columns(conn, table, columns):
+    """
+    Postgres REAL is float4, which rounds epoch seconds to multiples of 128.
+    Older databases created these columns as REAL; convert them to DOUBLE PRECISION.
+    """
+    if not DATABASE_URL:
+        return
+    cursor = execute_query(conn, '''
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = ? AND data_type = 'real'
+    ''', (table,))
+    for row in cursor.fetchall():
+        if row['column_name'] in columns:
+            execute_query(conn, f"ALTER TABLE {table} ALTER COLUMN {row['column_name']} TYPE DOUBLE PRECISION")
+
+def _migrate_sequence_columns(conn):
+    """
+    Adds the promoted sequence columns to older databases and backfills them from metadata.
+    """
+    existing = _existing_columns(conn, 'leads_archive')
+    for name, ddl in SEQUENCE_COLUMNS:
+        if name not in existing:
+            execute_query(conn, f"ALTER TABLE leads_archive ADD COLUMN {name} {ddl}")
+
+    existing = _existing_columns(conn, 'leads')
+    missing = [(name, ddl) for name, ddl in SEQUENCE_COLUMNS if name not in existing]
+    for name, ddl in missing:
+        execute_query(conn, f"ALTER TABLE leads ADD COLUMN {name} {ddl}")
+    if missing:
+        print(f"Migrated leads table: added {', '.join(name for name, _ in missing)}. Backfilling from metadata...")
+        execute_query(conn, _sequence_projection_sql())
+
+def ensure_indexes(conn):
+    """
+    Idempotently creates the managed INDEXES and drops OBSOLETE_INDEXES.
+    """
+    for name in OBSOLETE_INDEXES:
+        execute_query(conn, f"DROP INDEX IF EXISTS {name}")
+    for name, (table, columns, where) in INDEXES.items():
+        partial = f" WHERE {where}" if where else ""
+        execute_query(conn, f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns}){partial}")
+
+def _existing_indexes(conn):
+    """Secondary (non-unique, non-PK) indexes on leads/events: {name: table}."""
+    if DATABASE_URL:
+        cursor = execute_query(conn, '''
+            SELECT indexrelname AS name, relname AS tbl FROM pg_stat_user_indexes s
+            JOIN pg_index i ON i.indexrelid = s.indexrelid
+            WHERE relname IN ('leads', 'events') AND NOT i.indisunique AND NOT i.indisprimary
+        ''')
+    else:
+        cursor = execute_query(conn, '''
+            SELECT name, tbl_name AS tbl FROM sqlite_master
+            WHERE type = 'index' AND tbl_name IN ('leads', 'events') AND sql IS NOT NULL
+        ''')
+    return {row['name']: row['tbl'] for row in cursor.fetchall()}
+
+# Representative hot queries, used on SQLite to find which indexes the planner actually picks.
+_HOT_QUERIES = [
+    ("SELECT * FROM leads WHERE email = ?", ('x',)),
+    ("SELECT * FROM leads WHERE hubspot_id = ?", ('x',)),
+    ("SELECT * FROM leads WHERE status = ?", ('new',)),
+    (f"SELECT * FROM leads WHERE next_due_at <= ? AND {ACTIVE_LEADS_SQL}", ('x',)),
+    (f"SELECT MIN(next_due_at) FROM leads WHERE next_due_at > ? AND {ACTIVE_LEADS_SQL}", ('x',)),
+    ("SELECT * FROM leads WHERE sequence_stage = ? AND interest = ?", (1, 'x')),
+    ("SELECT * FROM events WHERE lead_id = ? ORDER BY timestamp DESC", (1,)),
+]
+
+def index_report():
+    """
+    Compares the managed INDEXES with the database.
+    Returns {'missing': [...], 'unused': [...], 'unmanaged': [...]}.
+    'unused' comes from pg_stat_user_indexes (idx_scan = 0) on Postgres and from
+    EXPLAIN QUERY PLAN over the hot queries on SQLite (which keeps no usage stats).
+    """
+    with db_connection() as conn:
+        existing = _existing_indexes(conn)
+        if DATABASE_URL:
+            cursor = execute_query(conn, '''
+                SELECT indexrelname AS name FROM pg_stat_user_indexes
+                WHERE relname IN ('leads', 'events') AND idx_scan = 0
+            ''')
+            never_scanned = {row['name'] for row in cursor.fetchall()}
+            unused = sorted(name for name in existing if name in never_scanned)
+        else:
+            used = set()
+            for query, params in _HOT_QUERIES:
+                for row in execute_query(conn, f"EXPLAIN QUERY PLAN {query}", params).fetchall():
+                    detail = row['detail']
+                    if ' INDEX ' in detail:
+                        used.add(detail.split(' INDEX ', 1)[1].split(' ')[0])
+            unused = sorted(name for name in existing if name not in used)
+
+    return {
+        'missing': sorted(name for name in INDEXES if name not in existing),
+        'unused': unused,
+        'unmanaged': sorted(name for name in existing if name not in INDEXES),
+    }
+
+def _sequence_projection_sql(where=""):
+    return _build_sequence_projection(where, get_dialect())
+
+@lru_cache(maxsize=32)
+def _build_sequence_projection(where, dialect):
+    """
+    UPDATE statement that recomputes the sequence columns from the metadata JSON.
+    Mirrors the defaults the Python code used (stage 0, interest 'general', flags false)
+    and precomputes next_due_at from the follow-up cadence.
+    """
+    if dialect == 'postgres':
+        doc = "safe_jsonb(metadata)"
+        get = lambda key: f"({doc}->>'{key}')"
+        stage = f"{get('sequence_stage')}::int"
+        contacted = f"{get('last_contacted_at')}::timestamp"
+        flag = lambda key: f"COALESCE({get(key)}::boolean, FALSE)"
+        add_days = lambda ts, days: f"({ts} + INTERVAL '{days} days')"
+        immediately = f"TIMESTAMP '{DUE_IMMEDIATELY}'"
+    else:
+        doc = "(CASE WHEN json_valid(metadata) THEN metadata END)"
+        get = lambda key: f"json_extract({doc}, '$.{key}')"
+        stage = get('sequence_stage')
+        contacted = get('last_contacted_at')
+        flag = lambda key: f"COALESCE({get(key)}, FALSE)"
+        # Same ISO layout as datetime.isoformat() so string comparisons stay ordered
+        add_days = lambda ts, days: f"strftime('%Y-%m-%dT%H:%M:%f', {ts}, '+{days} days')"
+        immediately = f"'{DUE_IMMEDIATELY}'"
+
+    # SET expressions see the old column values, so next_due_at is derived from metadata too
+    cadence = ' '.join(
+        f"WHEN COALESCE({stage}, 0) = {current} THEN {add_days(contacted, days)}"
+        for current, days in sorted(FOLLOW_UP_CADENCE_DAYS.items())
+    )
+    next_due = f'''CASE
+                WHEN {flag('do_not_contact')} OR {flag('meeting_booked')} OR {flag('has_replied')} THEN NULL
+                WHEN COALESCE({stage}, 0) = 0 THEN {immediately}
+                {cadence}
+                ELSE NULL
+            END'''
+
+    return f'''
+        UPDATE leads SET
+            sequence_stage = COALESCE({stage}, 0),
+            last_contacted_at = {contacted},
+            interest = COALESCE({get('interest')}, 'general'),
+            do_not_contact = {flag('do_not_contact')},
+            meeting_booked = {flag('meeting_booked')},
+            has_replied = {flag('has_replied')},
+            next_due_at = {next_due}
+        {where}
+    '''
+
+def _sync_sequence_columns(conn, keys, column='email'):
+    """Re-derives the sequence columns for the given leads inside the caller's transaction."""
+    keys = list(keys)
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        placeholders = ', '.join('?' for _ in chunk)
+        execute_query(conn, _sequence_projection_sql(f"WHERE {column} IN ({placeholders})"), tuple(chunk))
 
 def add_lead(lead_data):
-    conn = get_db_connection()
-    
     try:
-        cursor = execute_query(conn, '''
-            INSERT INTO leads (email, name, phone, source, metadata)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            lead_data.get('email'),
-            lead_data.get('name'),
-            lead_data.get('phone'),
-            lead_data.get('source'),
-            json.dumps(lead_data.get('metadata', {}))
-        ))
-        conn.commit()
-        return cursor.lastrowid
+        with db_connection() as conn:
+            cursor = execute_query(conn, '''
+                INSERT INTO leads (email, name, phone, source, metadata)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (
+                lead_data.get('email'),
+                lead_data.get('name'),
+                lead_data.get('phone'),
+                lead_data.get('source'),
+                json.dumps(lead_data.get('metadata', {}))
+            ))
+            lead_id = cursor.lastrowid
+            _sync_sequence_columns(conn, [lead_data.get('email')])
+        invalidate_lead(email=lead_data.get('email'))
+        return lead_id
     except sqlite3.IntegrityError:
         return None # Duplicate
     except Exception as e:
@@ -102,48 +870,528 @@ def add_lead(lead_data):
         if psycopg2 and isinstance(e, psycopg2.errors.UniqueViolation):
             return None
         raise e
-    finally:
-        conn.close()
 
-def get_lead_by_email(email):
-    conn = get_db_connection()
-    cursor = execute_query(conn, 'SELECT * FROM leads WHERE email = ?', (email,))
-    row = cursor.fetchone()
-    conn.close()
+# Existing leads keep their hubspot_id and have the incoming metadata keys merged
+# into (not replacing) their metadata, so sequence state survives a re-import.
+_UPSERT_SQLITE = '''
+    INSERT INTO leads (email, name, source, hubspot_id, metadata)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (email) DO UPDATE SET
+        name = COALESCE(excluded.name, leads.name),
+        hubspot_id = COALESCE(leads.hubspot_id, excluded.hubspot_id),
+        metadata = json_patch(CASE WHEN json_valid(leads.metadata) THEN leads.metadata ELSE '{}' END, excluded.metadata)
+'''
+
+_UPSERT_POSTGRES_CONFLICT = '''
+    ON CONFLICT (email) DO UPDATE SET
+        name = COALESCE(excluded.name, leads.name),
+        hubspot_id = COALESCE(leads.hubspot_id, excluded.hubspot_id),
+        metadata = (COALESCE(safe_jsonb(leads.metadata), '{}') || excluded.metadata::jsonb)::text
+'''
+
+def _upsert_row(row):
+    return (
+        row.get('email'),
+        row.get('name'),
+        row.get('source'),
+        row.get('hubspot_id'),
+        json.dumps(row.get('metadata') or {})
+    )
+
+def bulk_upsert_leads(rows):
+    """
+    Inserts or updates many leads (keyed by email) in a single transaction.
+    Each row is a dict with email, name, source, hubspot_id and metadata.
+    Returns the number of rows written.
+    """
+    # One row per email: Postgres refuses to upsert the same row twice in one statement
+    by_email = {row['email']: row for row in rows if row.get('email')}
+    params = [_upsert_row(row) for row in by_email.values()]
+    if not params:
+        return 0
+
+    with db_connection() as conn:
+        if not DATABASE_URL:
+            execute_many(conn, _UPSERT_SQLITE, params)
+        elif len(params) < BULK_COPY_THRESHOLD:
+            from psycopg2.extras import execute_values
+            execute_values(
+                conn.cursor(),
+                "INSERT INTO leads (email, name, source, hubspot_id, metadata) VALUES %s" + _UPSERT_POSTGRES_CONFLICT,
+                params
+            )
+        else:
+            _copy_upsert_postgres(conn, params)
+        _sync_sequence_columns(conn, by_email.keys())
+    lead_cache.invalidate(emails=by_email.keys())
+    return len(params)
+
+def _copy_upsert_postgres(conn, params):
+    """
+    Large Postgres loads: COPY into a temp staging table, then one INSERT ... SELECT.
+    """
+    import csv
+    import io
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in params:
+        writer.writerow(['\\N' if v is None else v for v in row])
+    buf.seek(0)
+
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TEMP TABLE leads_stage (
+            email TEXT, name TEXT, source TEXT, hubspot_id TEXT, metadata TEXT
+        ) ON COMMIT DROP
+    ''')
+    cursor.copy_expert("COPY leads_stage FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+    cursor.execute(
+        "INSERT INTO leads (email, name, source, hubspot_id, metadata) "
+        "SELECT email, name, source, hubspot_id, metadata FROM leads_stage"
+        + _UPSERT_POSTGRES_CONFLICT
+    )
+
+def delete_leads_by_email(emails):
+    """Deletes many leads in one transaction."""
+    emails = list(emails)
+    if not emails:
+        return 0
+    with db_connection() as conn:
+        execute_many(conn, "DELETE FROM leads WHERE email = ?", [(e,) for e in emails])
+    lead_cache.invalidate(emails=emails)
+    return len(emails)
+
+def _decode_lead(row):
+    """Turns a DB row into a Lead (metadata is decoded lazily)."""
+    return Lead.from_row(row)
+
+def get_lead_by_email(email, include_archived=True):
+    """
+    Looks a lead up by email (cached). Falls back to leads_archive, so converted /
+    disqualified / unsubscribed leads are still found after archival (they carry 'archived_at').
+    """
+    cached = lead_cache.get(email=email)
+    if cached and (include_archived or 'archived_at' not in cached):
+        return cached
+
+    generation = lead_cache.generation
+    with db_connection() as conn:
+        cursor = execute_prepared(conn, 'lead_by_email', 'SELECT * FROM leads WHERE email = ?', (email,))
+        row = cursor.fetchone()
+        if not row and include_archived:
+            cursor = execute_prepared(conn, 'archived_lead_by_email', 'SELECT * FROM leads_archive WHERE email = ?', (email,))
+            row = cursor.fetchone()
     
     if row:
-        lead = dict(row)
-        if lead.get('metadata') and isinstance(lead['metadata'], str):
-            try:
-                lead['metadata'] = json.loads(lead['metadata'])
-            except json.JSONDecodeError:
-                lead['metadata'] = {}
+        lead = _decode_lead(row)
+        lead_cache.put(lead, generation)
+        return lead
+    return None
+
+def get_lead_by_id(lead_id, include_archived=True):
+    cached = lead_cache.get(lead_id=lead_id)
+    if cached and (include_archived or 'archived_at' not in cached):
+        return cached
+
+    generation = lead_cache.generation
+    with db_connection() as conn:
+        cursor = execute_prepared(conn, 'lead_by_id', 'SELECT * FROM leads WHERE id = ?', (lead_id,))
+        row = cursor.fetchone()
+        if not row and include_archived:
+            cursor = execute_prepared(conn, 'archived_lead_by_id', 'SELECT * FROM leads_archive WHERE id = ?', (lead_id,))
+            row = cursor.fetchone()
+
+    if row:
+        lead = _decode_lead(row)
+        lead_cache.put(lead, generation)
         return lead
     return None
 
+def iter_leads(where="", params=(), columns="*", batch_size=None, decode=True):
+    """
+    Streams leads in id order using keyset pagination (WHERE id > last_id LIMIT n).
+    Only one page is held in memory, no transaction stays open between pages, and
+    metadata is decoded row by row as the caller consumes the generator.
+
+        for lead in iter_leads("status = ?", ('new',), columns="id, email, metadata"):
+            ...
+    """
+    batch_size = batch_size or STREAM_BATCH_SIZE
+    query = f"SELECT {columns} FROM leads WHERE id > ? {'AND (' + where + ')' if where else ''} ORDER BY id LIMIT ?"
+    last_id = 0
+    while True:
+        with db_connection() as conn:
+            rows = execute_query(conn, query, (last_id,) + tuple(params) + (batch_size,)).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield _decode_lead(row) if decode else dict(row)
+        last_id = rows[-1]['id']
+        if len(rows) < batch_size:
+            return
+
+def iter_active_leads(columns="*", batch_size=None):
+    """Streams leads that are not in a terminal status."""
+    return iter_leads(ACTIVE_LEADS_SQL, (), columns, batch_size)
+
+def update_lead_metadata(lead_id, metadata):
+    """
+    Replaces a lead's metadata and refreshes the promoted sequence columns.
+    """
+    with db_connection() as conn:
+        execute_prepared(conn, 'update_lead_metadata', 'UPDATE leads SET metadata = ? WHERE id = ?', (json.dumps(metadata), lead_id))
+        execute_prepared(conn, 'sync_sequence_by_id', _sequence_projection_sql("WHERE id = ?"), (lead_id,))
+    invalidate_lead(lead_id=lead_id)
+
+def patch_lead_metadata(lead_id, patch):
+    """
+    Merges `patch` into one lead's metadata in the database (no read-modify-write).
+    Top-level keys are replaced (not deep-merged); keys set to None are removed.
+    """
+    return patch_leads_metadata({lead_id: patch})
+
+@lru_cache(maxsize=64)
+def _sqlite_patch_sql(set_count, drop_count):
+    """UPDATE that removes drop_count top-level keys, then sets set_count keys to JSON values."""
+    doc = "CASE WHEN json_valid(metadata) THEN metadata ELSE '{}' END"
+    if drop_count:
+        doc = f"json_remove({doc}, {', '.join(['?'] * drop_count)})"
+    if set_count:
+        doc = f"json_set({doc}, {', '.join(['?, json(?)'] * set_count)})"
+    return f"UPDATE leads SET metadata = {doc} WHERE id = ?"
+
+def patch_leads_metadata(patches):
+    """
+    Applies {lead_id: patch} metadata merges for many leads in one transaction.
+    The merge is shallow on both backends: each top-level key in the patch replaces the
+    stored value whole (nested objects are not merged), and keys set to None are removed.
+    Merging happens server-side (json_set/json_remove on SQLite, jsonb || on Postgres), so
+    concurrent writers (daemon, Slack server) don't overwrite each other's keys.
+    """
+    patches = {lead_id: patch for lead_id, patch in dict(patches).items() if patch}
+    if not patches:
+        return 0
+
+    with db_connection() as conn:
+        if DATABASE_URL and len(patches) == 1:
+            # Single-lead patches are the hot path: use prepared statements
+            (lead_id, patch), = patches.items()
+            execute_prepared(conn, 'patch_lead_metadata', '''
+                UPDATE leads SET metadata = (
+                    (COALESCE(NULLIF(metadata, ''), '{}')::jsonb || ?::jsonb)
+                    - ARRAY(SELECT jsonb_array_elements_text(?::jsonb))
+                )::text
+                WHERE id = ?
+            ''', (
+                json.dumps({k: v for k, v in patch.items() if v is not None}),
+                json.dumps([k for k, v in patch.items() if v is None]),
+                lead_id
+            ))
+            execute_prepared(conn, 'sync_sequence_by_id', _sequence_projection_sql("WHERE id = ?"), (lead_id,))
+        elif DATABASE_URL:
+            from psycopg2.extras import execute_values
+            rows = [
+                (
+                    lead_id,
+                    json.dumps({k: v for k, v in patch.items() if v is not None}),
+                    json.dumps([k for k, v in patch.items() if v is None])
+                )
+                for lead_id, patch in patches.items()
+            ]
+            execute_values(conn.cursor(), '''
+                UPDATE leads SET metadata = (
+                    (COALESCE(NULLIF(leads.metadata, ''), '{}')::jsonb || p.patch::jsonb)
+                    - ARRAY(SELECT jsonb_array_elements_text(p.drop_keys::jsonb))
+                )::text
+                FROM (VALUES %s) AS p (id, patch, drop_keys)
+                WHERE leads.id = p.id
+            ''', rows)
+        else:
+            # Leads are grouped by patch shape so each group is one executemany
+            groups = {}
+            for lead_id, patch in patches.items():
+                set_keys = [k for k, v in patch.items() if v is not None]
+                drop_keys = [k for k, v in patch.items() if v is None]
+                params = [f'$."{k}"' for k in drop_keys]
+                for k in set_keys:
+                    params += [f'$."{k}"', json.dumps(patch[k])]
+                groups.setdefault((len(set_keys), len(drop_keys)), []).append((*params, lead_id))
+            for (set_count, drop_count), rows in groups.items():
+                execute_many(conn, _sqlite_patch_sql(set_count, drop_count), rows)
+        if not (DATABASE_URL and len(patches) == 1):
+            _sync_sequence_columns(conn, patches.keys(), column='id')
+    lead_cache.invalidate(lead_ids=patches.keys())
+    return len(patches)
+
+def get_due_leads(now=None):
+    """
+    Returns active leads whose next sequence stage is due, ordered by (stage, interest).
+    Cadence and suppression are already folded into next_due_at, so this is a range scan.
+    """
+    now = now or datetime.now()
+    query = f'''
+        SELECT * FROM leads
+        WHERE next_due_at <= ?
+          AND {ACTIVE_LEADS_SQL}
+    '''
+    with db_connection() as conn:
+        cursor = execute_query(conn, query, (now.isoformat(),))
+        rows = cursor.fetchall()
+    # Sorted here rather than in SQL so the planner sticks to the next_due_at range scan
+    leads = [_decode_lead(row) for row in rows]
+    leads.sort(key=lambda lead: (lead['sequence_stage'], lead['interest'] or '', lead['id']))
+    return leads
+
+def get_next_due_at(after=None):
+    """
+    Returns when the next lead becomes due (strictly after `after`, default now), or None.
+    Used by the daemon to sleep until there is work to do.
+    """
+    after = after or datetime.now()
+    with db_connection() as conn:
+        cursor = execute_query(conn, f'''
+            SELECT MIN(next_due_at) AS next_due_at FROM leads
+            WHERE next_due_at > ?
+              AND {ACTIVE_LEADS_SQL}
+        ''', (after.isoformat(),))
+        row = cursor.fetchone()
+
+    value = row['next_due_at'] if row else None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value
+
+def save_lead(lead):
+    """
+    Persists only what changed on a Lead: dirty columns in one UPDATE,
+    and the metadata diff as a server-side patch. Returns True if anything was written.
+    """
+    columns, patch = lead.changes()
+    if columns:
+        assignments = ', '.join(f"{key} = ?" for key in columns)
+        with db_connection() as conn:
+            execute_query(conn, f"UPDATE leads SET {assignments} WHERE id = ?", tuple(columns.values()) + (lead['id'],))
+        invalidate_lead(email=lead.get('email'), lead_id=lead['id'])
+    if patch:
+        patch_lead_metadata(lead['id'], patch)
+    lead.mark_clean()
+    return bool(columns or patch)
+
+def archive_terminal_leads(batch_size=None):
+    """
+    Moves leads in a TERMINAL_STATUSES state, and their events, into leads_archive /
+    events_archive, batch by batch (one transaction each). Keeps the hot table limited
+    to leads the sequence can still act on. Returns the number of leads archived.
+    """
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    placeholders = ', '.join('?' for _ in TERMINAL_STATUSES)
+    total = 0
+
+    while True:
+        with db_connection() as conn:
+            columns = sorted(_existing_columns(conn, 'leads'))
+            rows = execute_query(
+                conn,
+                f"SELECT id, email FROM leads WHERE status IN ({placeholders}) ORDER BY id LIMIT ?",
+                TERMINAL_STATUSES + (batch_size,)
+            ).fetchall()
+            if not rows:
+                break
+
+            ids = tuple(row['id'] for row in rows)
+            emails = [row['email'] for row in rows]
+            in_ids = ', '.join('?' for _ in ids)
+            column_list = ', '.join(columns)
+
+            # A lead archived before, restored, then closed again replaces its old archive row
+            execute_query(conn, f"DELETE FROM leads_archive WHERE email IN ({', '.join('?' for _ in emails)})", tuple(emails))
+            execute_query(conn, f"INSERT INTO leads_archive ({column_list}) SELECT {column_list} FROM leads WHERE id IN ({in_ids})", ids)
+            execute_query(conn, f'''
+                INSERT INTO events_archive (id, lead_id, event_type, details, timestamp)
+                SELECT id, lead_id, event_type, details, timestamp FROM events WHERE lead_id IN ({in_ids})
+            ''', ids)
+            execute_query(conn, f"DELETE FROM events WHERE lead_id IN ({in_ids})", ids)
+            execute_query(conn, f"DELETE FROM leads WHERE id IN ({in_ids})", ids)
+
+        lead_cache.invalidate(emails=emails, lead_ids=ids)
+        total += len(ids)
+        if len(ids) < batch_size:
+            break
+    return total
+
+def get_archived_emails(emails=None):
+    """
+    Emails of archived leads (so importers don't re-create them as new leads).
+    When emails is given, only those are checked instead of loading the whole archive.
+    """
+    with db_connection() as conn:
+        if emails is None:
+            rows = execute_query(conn, "SELECT email FROM leads_archive").fetchall()
+        else:
+            emails = list(emails)
+            rows = []
+            for i in range(0, len(emails), ARCHIVE_BATCH_SIZE):
+                chunk = emails[i:i + ARCHIVE_BATCH_SIZE]
+                placeholders = ", ".join("?" for _ in chunk)
+                rows.extend(execute_query(
+                    conn, f"SELECT email FROM leads_archive WHERE email IN ({placeholders})", chunk
+                ).fetchall())
+    return {row['email'] for row in rows}
+
+# Token buckets shared by every process using this database (see rate_limiter.py)
+_RATE_LIMITS_DDL = '''
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        name TEXT PRIMARY KEY,
+        tokens DOUBLE PRECISION NOT NULL,
+        updated_at DOUBLE PRECISION NOT NULL
+    )
+'''
+_rate_limits_ready = False
+
+def reserve_rate_limit_token(name, rate, capacity, now=None):
+    """
+    Takes one token from the named bucket (refilled at `rate` tokens/second, up to
+    `capacity`) and returns how many seconds the caller must wait before using it.
+    The balance may go negative: each caller reserves its own slot, so concurrent
+    threads and processes are spaced out instead of all retrying at once.
+    """
+    global _rate_limits_ready
+    now = time.time() if now is None else now
+    least, greatest = ('LEAST', 'GREATEST') if DATABASE_URL else ('MIN', 'MAX')
+    with db_connection() as conn:
+        if not _rate_limits_ready:
+            execute_query(conn, _RATE_LIMITS_DDL)
+            _rate_limits_ready = True
+        # The UPDATE takes the write lock first, so the read below sees our own reservation
+        cursor = execute_query(conn, f'''
+            UPDATE rate_limits
+            SET tokens = {least}(?, tokens + {greatest}(0, ? - updated_at) * ?) - 1, updated_at = ?
+            WHERE name = ?
+        ''', (capacity, now, rate, now, name))
+        if cursor.rowcount == 0:
+            execute_query(conn, '''
+                INSERT INTO rate_limits (name, tokens, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET tokens = rate_limits.tokens - 1
+            ''', (name, capacity - 1, now))
+        tokens = execute_query(conn, "SELECT tokens FROM rate_limits WHERE name = ?", (name,)).fetchone()['tokens']
+    return max(0.0, -tokens / rate)
+
+def get_pushed_properties(contact_ids, max_age=None):
+    """
+    Last pushed HubSpot property values as {contact_id: {property: value}}.
+    Entries older than max_age seconds are ignored (treated as unknown).
+    """
+    contact_ids = [str(c) for c in contact_ids]
+    since = time.time() - max_age if max_age else 0
+    pushed = {}
+    with db_connection() as conn:
+        for i in range(0, len(contact_ids), ARCHIVE_BATCH_SIZE):
+            chunk = contact_ids[i:i + ARCHIVE_BATCH_SIZE]
+            placeholders = ", ".join("?" for _ in chunk)
+            rows = execute_query(conn, f'''
+                SELECT contact_id, property, value FROM hubspot_pushed_properties
+                WHERE contact_id IN ({placeholders}) AND pushed_at >= ?
+            ''', chunk + [since]).fetchall()
+            for row in rows:
+                pushed.setdefault(row['contact_id'], {})[row['property']] = row['value']
+    return pushed
+
+def record_pushed_properties(updates):
+    """Remembers values HubSpot accepted. updates: iterable of (contact_id, {property: value})."""
+    now = time.time()
+    params = [
+        (str(contact_id), prop, None if value is None else str(value), now)
+        for contact_id, properties in updates
+        for prop, value in properties.items()
+    ]
+    if not params:
+        return
+    with db_connection() as conn:
+        execute_many(conn, '''
+            INSERT INTO hubspot_pushed_properties (contact_id, property, value, pushed_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(contact_id, property) DO UPDATE SET value = excluded.value, pushed_at = excluded.pushed_at
+        ''', params)
+
+# Per-day usage counters (e.g. Gmail sends per mailbox), shared by every process
+_DAILY_QUOTAS_DDL = '''
+    CREATE TABLE IF NOT EXISTS daily_quotas (
+        name TEXT NOT NULL,
+        day TEXT NOT NULL,
+        used INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (name, day)
+    )
+'''
+_daily_quotas_ready = False
+
+def consume_daily_quota(name, limit, day=None):
+    """
+    Atomically uses one unit of today's quota. Returns False (and uses nothing)
+    once `limit` units have been used today.
+    """
+    global _daily_quotas_ready
+    day = day or datetime.now().strftime('%Y-%m-%d')
+    with db_connection() as conn:
+        if not _daily_quotas_ready:
+            execute_query(conn, _DAILY_QUOTAS_DDL)
+            _daily_quotas_ready = True
+        execute_query(conn, '''
+            INSERT INTO daily_quotas (name, day, used) VALUES (?, ?, 0)
+            ON CONFLICT(name, day) DO NOTHING
+        ''', (name, day))
+        cursor = execute_query(
+            conn, "UPDATE daily_quotas SET used = used + 1 WHERE name = ? AND day = ? AND used < ?",
+            (name, day, limit)
+        )
+        return cursor.rowcount == 1
+
+def refund_daily_quota(name, day):
+    """Gives back one unit taken by consume_daily_quota on `day` (e.g. the send failed)."""
+    with db_connection() as conn:
+        execute_query(
+            conn, "UPDATE daily_quotas SET used = used - 1 WHERE name = ? AND day = ? AND used > 0",
+            (name, day)
+        )
+
+def get_sync_state(key, default=None):
+    """Reads a persisted sync watermark/cursor (stored as text)."""
+    with db_connection() as conn:
+        row = execute_query(conn, "SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return row['value'] if row and row['value'] is not None else default
+
+def set_sync_state(key, value):
+    """Persists a sync watermark/cursor; None clears it."""
+    with db_connection() as conn:
+        execute_query(conn, '''
+            INSERT INTO sync_state (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+        ''', (key, None if value is None else str(value)))
+
 def update_lead_hubspot_id(local_id, hubspot_id):
-    conn = get_db_connection()
-    execute_query(conn, 'UPDATE leads SET hubspot_id = ? WHERE id = ?', (hubspot_id, local_id))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        execute_query(conn, 'UPDATE leads SET hubspot_id = ? WHERE id = ?', (hubspot_id, local_id))
+    invalidate_lead(lead_id=local_id)
 
 def update_lead_analysis(lead_id, analysis):
-    conn = get_db_connection()
-    execute_query(conn, '''
-        UPDATE leads 
-        SET lead_score = ?, intent = ?, status = ?
-        WHERE id = ?
-    ''', (
-        analysis.get('score'),
-        analysis.get('intent'),
-        'analyzed',
-        lead_id
-    ))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        execute_query(conn, '''
+            UPDATE leads 
+            SET lead_score = ?, intent = ?, status = ?
+            WHERE id = ?
+        ''', (
+            analysis.get('score'),
+            analysis.get('intent'),
+            'analyzed',
+            lead_id
+        ))
+    invalidate_lead(lead_id=lead_id)
 
 if __name__ == '__main__':
     init_db()
+    if '--index-report' in sys.argv:
+        report = index_report()
+        for key in ('missing', 'unused', 'unmanaged'):
+            print(f"{key.capitalize()} indexes: {', '.join(report[key]) or 'none'}")
     if DATABASE_URL:
         print("Database initialized (PostgreSQL)")
     else:
@@ -0,0 +1,53 @@
+import os
+import time
+
+# Gmail accepts up to 100 calls per batch, but recommends 50 to avoid per-user rate limiting
+GMAIL_BATCH_MAX = 100
+GMAIL_BATCH_SIZE = min(GMAIL_BATCH_MAX, int(os.getenv("GMAIL_BATCH_SIZE", "50")))
+METADATA_HEADERS = ['From', 'To', 'Cc', 'Date', 'Subject']
+RETRYABLE_STATUSES = {429, 500, 503}
+
+def _http_status(error):
+    resp = getattr(error, 'resp', None)
+    return getattr(resp, 'status', None)
+
+def get_messages(service, message_ids, format='metadata', headers=None, batch_size=None):
+    """
+    Fetches many messages with BatchHttpRequest (one HTTP round trip per batch).
+    format='metadata' returns only the requested headers plus snippet/internalDate/labelIds,
+    which is all the sync scripts need. Returns {message_id: message}; messages that still
+    fail after one retry are reported and left out.
+    """
+    batch_size = min(GMAIL_BATCH_MAX, batch_size or GMAIL_BATCH_SIZE)
+    headers = METADATA_HEADERS if headers is None else headers
+    results = {}
+    pending = list(dict.fromkeys(message_ids))
+
+    for attempt in range(2):
+        retry = []
+        for i in range(0, len(pending), batch_size):
+            chunk = pending[i:i + batch_size]
+
+            def callback(request_id, response, exception):
+                if exception is None:
+                    results[request_id] = response
+                elif attempt == 0 and _http_status(exception) in RETRYABLE_STATUSES:
+                    retry.append(request_id)
+                else:
+                    print(f"Error fetching message {request_id}: {exception}")
+
+            batch = service.new_batch_http_request(callback=callback)
+            for msg_id in chunk:
+                kwargs = {'userId': 'me', 'id': msg_id, 'format': format}
+                if format == 'metadata':
+                    kwargs['metadataHeaders'] = headers
+                batch.add(service.users().messages().get(**kwargs), request_id=msg_id)
+            batch.execute()
+
+        if not retry:
+            break
+        print(f"Retrying {len(retry)} rate-limited message fetches...")
+        time.sleep(1)
+        pending = retry
+
+    return results
@@ -0,0 +1,98 @@
+import os
+import sys
+from email.utils import getaddresses
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Mailbox position (Gmail historyId) up to which replies have been processed
+HISTORY_STATE_KEY = 'gmail_history_id'
+HISTORY_PAGE_SIZE = 500
+
+class HistoryExpired(Exception):
+    """The stored historyId is older than the history Gmail keeps (about a week); do a full scan."""
+
+def _http_status(error):
+    resp = getattr(error, 'resp', None)
+    return getattr(resp, 'status', None)
+
+def get_current_history_id(service):
+    return service.users().getProfile(userId='me').execute()['historyId']
+
+def list_added_message_ids(service, start_history_id):
+    """
+    Ids of messages added to the mailbox since start_history_id (drafts excluded), oldest first.
+    Returns (message_ids, latest_history_id). Raises HistoryExpired if Gmail no longer has
+    history that far back.
+    """
+    message_ids = []
+    seen = set()
+    latest_history_id = start_history_id
+    page_token = None
+    while True:
+        try:
+            response = service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                maxResults=HISTORY_PAGE_SIZE,
+                pageToken=page_token
+            ).execute()
+        except Exception as e:
+            if _http_status(e) == 404:
+                raise HistoryExpired(f"historyId {start_history_id} is no longer available") from e
+            raise
+
+        latest_history_id = response.get('historyId', latest_history_id)
+        for record in response.get('history', []):
+            for added in record.get('messagesAdded', []):
+                message = added['message']
+                if 'DRAFT' in message.get('labelIds', []) or message['id'] in seen:
+                    continue
+                seen.add(message['id'])
+                message_ids.append(message['id'])
+
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return message_ids, latest_history_id
+
+def header(message, name):
+    headers = message.get('payload', {}).get('headers', [])
+    return next((h['value'] for h in headers if h['name'].lower() == name.lower()), '')
+
+def message_addresses(message):
+    """(sender, recipients) as lower-cased bare email addresses."""
+    senders = [addr.lower() for _, addr in getaddresses([header(message, 'From')]) if addr]
+    recipients = [
+        addr.lower()
+        for _, addr in getaddresses([header(message, 'To'), header(message, 'Cc')])
+        if addr
+    ]
+    return (senders[0] if senders else ''), recipients
+
+def latest_messages_by_lead(messages, leads_by_email):
+    """
+    Matches messages to leads by sender/recipient address (leads_by_email keys are lower-cased)
+    and keeps the newest message per lead, in the same shape as a per-lead search:
+    {email: {"content", "is_from_lead", "date"}}.
+    """
+    latest = {}
+    for message in messages:
+        internal_date = int(message.get('internalDate', 0))
+        sender, recipients = message_addresses(message)
+
+        matches = []
+        if sender in leads_by_email:
+            matches.append((sender, True))
+        matches.extend((addr, False) for addr in recipients if addr in leads_by_email)
+
+        for email, is_from_lead in matches:
+            current = latest.get(email)
+            if current and current['internal_date'] >= internal_date:
+                continue
+            latest[email] = {
+                "content": message.get('snippet', ''),
+                "is_from_lead": is_from_lead,
+                "date": header(message, 'Date'),
+                "internal_date": internal_date
+            }
+    return latest
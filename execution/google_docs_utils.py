@@ -1,16 +1,14 @@
 import sys
 import os
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 # Add parent dir to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from execution.google_auth import get_credentials
+from execution.google_services import get_google_service
 
 def get_docs_service():
-    creds = get_credentials()
-    return build('docs', 'v1', credentials=creds)
+    return get_google_service('docs', 'v1')
 
 def read_structural_elements(elements):
     """Recursively read text from structural elements."""
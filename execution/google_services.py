@@ -0,0 +1,73 @@
+import os
+import sys
+import threading
+
+import httplib2
+import google_auth_httplib2
+from googleapiclient.discovery import build
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution.google_auth import get_credentials
+
+# Socket timeout for Google API calls (seconds)
+GOOGLE_HTTP_TIMEOUT = int(os.getenv("GOOGLE_HTTP_TIMEOUT", "60"))
+
+_credentials = {} # credentials loader -> credentials (loaded once per process)
+_credentials_lock = threading.Lock()
+_local = threading.local()
+
+def _get_credentials(loader):
+    creds = _credentials.get(loader)
+    if creds is None:
+        with _credentials_lock:
+            creds = _credentials.get(loader)
+            if creds is None:
+                creds = loader()
+                _credentials[loader] = creds
+    return creds
+
+def _thread_state():
+    # httplib2.Http is not thread-safe, and sockets must not cross a fork
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.http = {}
+        _local.services = {}
+    return _local
+
+def get_authorized_http(credentials_loader=get_credentials):
+    """The calling thread's authorized transport (shared by all APIs in that thread)."""
+    state = _thread_state()
+    http = state.http.get(credentials_loader)
+    if http is None:
+        creds = _get_credentials(credentials_loader)
+        # Expired tokens are refreshed in place by AuthorizedHttp
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=GOOGLE_HTTP_TIMEOUT))
+        state.http[credentials_loader] = http
+    return http
+
+def get_google_service(api, version, credentials_loader=get_credentials):
+    """
+    Returns a cached API client for (api, version) for the calling thread.
+    Built once from the discovery documents bundled with googleapiclient (no network
+    fetch), on top of the thread's shared authorized transport.
+    """
+    state = _thread_state()
+    key = (api, version, credentials_loader)
+    service = state.services.get(key)
+    if service is None:
+        service = build(
+            api, version,
+            http=get_authorized_http(credentials_loader),
+            static_discovery=True,
+            cache_discovery=False
+        )
+        state.services[key] = service
+    return service
+
+def clear_services():
+    """Drops the calling thread's cached services and transport (e.g. after re-authenticating)."""
+    _local.pid = None
+    with _credentials_lock:
+        _credentials.clear()
@@ -1,20 +1,142 @@
 import os
+import sys
 from hubspot import HubSpot
-from hubspot.crm.contacts import SimplePublicObjectInput
-from hubspot.crm.objects.notes import SimplePublicObjectInputForCreate
-from hubspot.crm.objects.notes import ApiException as NoteApiException
+from hubspot.crm.contacts import (
+    SimplePublicObjectInput, PublicObjectSearchRequest,
+    SimplePublicObjectBatchInput, BatchInputSimplePublicObjectBatchInput,
+    BatchReadInputSimplePublicObjectId, SimplePublicObjectId
+)
+from hubspot.crm.objects.notes import SimplePublicObjectInputForCreate, BatchInputSimplePublicObjectInputForCreate
 from dotenv import load_dotenv
 import certifi
 import datetime
+import threading
+import socket
+import urllib3
+from urllib3.connection import HTTPConnection
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution.rate_limiter import (
+    TokenBucket, ThrottleStats, call_with_retry, report_at_exit, RETRYABLE_STATUSES, THROTTLED_STATUSES
+)
+from execution.db import get_pushed_properties, record_pushed_properties
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
 os.environ['SSL_CERT_FILE'] = certifi.where()
 
+# HubSpot API limits for this app (shared by every process through the local DB)
+HUBSPOT_REQUESTS_PER_10S = int(os.getenv("HUBSPOT_REQUESTS_PER_10S", "100"))
+HUBSPOT_REQUESTS_PER_DAY = int(os.getenv("HUBSPOT_REQUESTS_PER_DAY", "250000"))
+# The CRM search endpoints have their own, lower limit
+HUBSPOT_SEARCH_PER_SECOND = int(os.getenv("HUBSPOT_SEARCH_PER_SECOND", "4"))
+
+RATE_LIMITS = [
+    TokenBucket('hubspot_10s', HUBSPOT_REQUESTS_PER_10S, 10),
+    TokenBucket('hubspot_daily', HUBSPOT_REQUESTS_PER_DAY, 86400),
+]
+SEARCH_RATE_LIMITS = RATE_LIMITS + [TokenBucket('hubspot_search', HUBSPOT_SEARCH_PER_SECOND, 1)]
+
+throttle_stats = ThrottleStats()
+
+# SDK methods that must not be repeated after a 5xx (the write may already have been applied,
+# so a retry would duplicate contacts or notes). They are only retried on 429.
+NON_IDEMPOTENT_METHODS = ('create', 'merge')
+
+# A value we pushed is trusted for this long; after that it is re-sent even if unchanged
+# (covers edits made directly in HubSpot). 0 disables the cache.
+PUSH_CACHE_TTL = float(os.getenv("HUBSPOT_PUSH_CACHE_TTL_HOURS", "24")) * 3600
+report_at_exit("HubSpot", throttle_stats)
+
+# Connections kept alive per host in the shared HTTP pool (threads beyond this wait for one)
+HUBSPOT_POOL_MAXSIZE = int(os.getenv("HUBSPOT_POOL_MAXSIZE", "10"))
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def _shared_pool_manager():
+    """One keep-alive urllib3 pool shared by every HubSpot API object in this process."""
+    socket_options = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    return urllib3.PoolManager(
+        num_pools=4,
+        maxsize=HUBSPOT_POOL_MAXSIZE,
+        block=True,
+        cert_reqs='CERT_REQUIRED',
+        ca_certs=certifi.where(),
+        socket_options=socket_options
+    )
+
+class _RateLimitedApi:
+    """
+    Routes every public method of an SDK API object through the rate limiter and retries.
+    Creates are retried only when throttled (see NON_IDEMPOTENT_METHODS).
+    """
+    def __init__(self, api, buckets):
+        self._api = api
+        self._buckets = buckets
+
+    def __getattr__(self, name):
+        value = getattr(self._api, name)
+        if name.startswith('_') or not callable(value):
+            return value
+        retry_statuses = THROTTLED_STATUSES if name in NON_IDEMPOTENT_METHODS else RETRYABLE_STATUSES
+        def limited(*args, **kwargs):
+            return call_with_retry(
+                value, *args, buckets=self._buckets, stats=throttle_stats,
+                retry_statuses=retry_statuses, **kwargs
+            )
+        return limited
+
+class _SharedApi:
+    """
+    Wraps the HubSpot client so each discovery namespace and API object is built once.
+    The SDK builds a new ApiClient (and urllib3 pool) on every `client.crm.contacts.basic_api`
+    access; cached here, all APIs reuse one pool and TLS connections stay open between calls.
+    API methods are rate limited and retried on 429 (and 5xx when idempotent, see _RateLimitedApi).
+    """
+    def __init__(self, target, pool_manager):
+        self._target = target
+        self._pool_manager = pool_manager
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        cached = self._cache.get(name)
+        if cached is not None:
+            return cached
+        with self._lock:
+            if name in self._cache:
+                return self._cache[name]
+            value = getattr(self._target, name)
+            if hasattr(value, 'api_client'):
+                rest_client = getattr(value.api_client, 'rest_client', None)
+                if rest_client is not None and hasattr(rest_client, 'pool_manager'):
+                    rest_client.pool_manager = self._pool_manager
+                value = _RateLimitedApi(value, SEARCH_RATE_LIMITS if name == 'search_api' else RATE_LIMITS)
+            elif type(value).__module__.startswith('hubspot.discovery'):
+                value = _SharedApi(value, self._pool_manager)
+            else:
+                return value
+            self._cache[name] = value
+            return value
+
 def get_hubspot_client():
-    access_token = os.getenv('HUBSPOT_ACCESS_TOKEN')
-    if not access_token:
-        raise ValueError("HUBSPOT_ACCESS_TOKEN not found in .env")
-    return HubSpot(access_token=access_token)
+    """
+    Returns the process-wide HubSpot client, created on first use. Thread-safe.
+    A forked child gets its own client (pooled sockets can't be shared across processes).
+    """
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            access_token = os.getenv('HUBSPOT_ACCESS_TOKEN')
+            if not access_token:
+                raise ValueError("HUBSPOT_ACCESS_TOKEN not found in .env")
+            _client = _SharedApi(HubSpot(access_token=access_token), _shared_pool_manager())
+            _client_pid = os.getpid()
+    return _client
 
 def create_contact(lead_data):
     client = get_hubspot_client()
@@ -37,10 +159,10 @@ def create_contact(lead_data):
             return None
         raise e
 
-def log_note(contact_id, note_body):
-    client = get_hubspot_client()
+def _note_input(contact_id, note_body, timestamp=None):
+    timestamp = timestamp or datetime.datetime.now()
     properties = {
-        "hs_timestamp": str(int(datetime.datetime.now().timestamp() * 1000)), 
+        "hs_timestamp": str(int(timestamp.timestamp() * 1000)), 
         "hs_note_body": note_body
     }
     
@@ -55,41 +177,385 @@ def log_note(contact_id, note_body):
             ]
         }
     ]
-    
+    return SimplePublicObjectInputForCreate(properties=properties, associations=associations)
+
+def log_note(contact_id, note_body):
+    client = get_hubspot_client()
     try:
-        note_input = SimplePublicObjectInputForCreate(properties=properties, associations=associations)
+        note_input = _note_input(contact_id, note_body)
         note_response = client.crm.objects.notes.basic_api.create(simple_public_object_input_for_create=note_input)
         return note_response.id
     except Exception as e:
         print(f"Failed to log note: {e}")
         return None
 
-def get_all_contacts():
+BATCH_NOTE_SIZE = 100 # HubSpot maximum for notes batch_api.create
+
+class NoteBuffer:
+    """
+    Queues notes and creates them through the notes batch create endpoint (with the
+    contact association), BATCH_NOTE_SIZE per call. Notes queued for the same contact
+    before a flush are coalesced into a single note.
+    """
+    separator = "\n\n---\n\n"
+
+    def __init__(self, batch_size=BATCH_NOTE_SIZE):
+        self.batch_size = batch_size
+        self._pending = {} # contact_id -> (latest timestamp, [bodies])
+        self._lock = threading.Lock()
+        self.created = 0
+        self.errors = {} # contact_id -> error message
+
+    def add(self, contact_id, note_body, timestamp=None):
+        if not contact_id:
+            return
+        timestamp = timestamp or datetime.datetime.now()
+        with self._lock:
+            latest, bodies = self._pending.get(str(contact_id), (timestamp, []))
+            bodies.append(note_body)
+            self._pending[str(contact_id)] = (max(latest, timestamp), bodies)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Creates all pending notes. Returns the number of notes created by this call."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        
+        client = get_hubspot_client()
+        items = [
+            (contact_id, self.separator.join(bodies), timestamp)
+            for contact_id, (timestamp, bodies) in pending.items()
+        ]
+        created = 0
+        for i in range(0, len(items), self.batch_size):
+            created += self._send_batch(client, items[i:i + self.batch_size])
+        self.created += created
+        return created
+
+    def _send_batch(self, client, items):
+        """Returns the number of notes HubSpot created."""
+        batch_input = BatchInputSimplePublicObjectInputForCreate(inputs=[
+            _note_input(contact_id, body, timestamp) for contact_id, body, timestamp in items
+        ])
+        try:
+            api_response = client.crm.objects.notes.batch_api.create(
+                batch_input_simple_public_object_input_for_create=batch_input
+            )
+        except Exception as e:
+            status = getattr(e, 'status', None)
+            if not isinstance(status, int) or not 400 <= status < 500 or status == 429:
+                # 5xx / timeout: the notes may already exist, so re-creating them could duplicate
+                print(f"Batch note create of {len(items)} notes failed ({e}); not retrying.")
+                for contact_id, _, _ in items:
+                    self.errors[contact_id] = str(e)
+                return 0
+            # A 4xx rejected the whole batch (e.g. one bad association): retry one by one
+            print(f"Batch note create of {len(items)} notes failed ({e}); retrying individually.")
+            created = 0
+            for contact_id, body, timestamp in items:
+                try:
+                    client.crm.objects.notes.basic_api.create(
+                        simple_public_object_input_for_create=_note_input(contact_id, body, timestamp)
+                    )
+                    created += 1
+                except Exception as item_error:
+                    self.errors[contact_id] = str(item_error)
+                    print(f"Failed to log note for contact {contact_id}: {item_error}")
+            return created
+        
+        for error in getattr(api_response, 'errors', None) or []:
+            print(f"Failed to log note: {error.message}")
+        return len(getattr(api_response, 'results', None) or [])
+
+CONTACT_PROPERTIES = ["email", "firstname", "lastname", "lifecyclestage", "company", "interest"]
+CONTACT_PAGE_SIZE = 100 # HubSpot maximum for basic_api.get_page
+
+def iter_contact_pages(properties=None, page_size=CONTACT_PAGE_SIZE):
+    """
+    Yields HubSpot contacts one page (list) at a time, following the paging.next.after cursor
+    until the portal is exhausted. Only one page is held in memory.
+    Raises if a page fails, so callers can tell a partial fetch from a complete one.
+    """
     client = get_hubspot_client()
-    try:
-        # Get all contacts with email and firstname/lastname
-        api_response = client.crm.contacts.basic_api.get_page(
-            limit=100,
-            properties=["email", "firstname", "lastname", "lifecyclestage", "company", "interest"],
-            archived=False
+    after = None
+    while True:
+        try:
+            api_response = client.crm.contacts.basic_api.get_page(
+                limit=page_size,
+                after=after,
+                properties=properties or CONTACT_PROPERTIES,
+                archived=False
+            )
+        except Exception as e:
+            print(f"Error fetching contacts (after={after}): {e}")
+            raise
+        
+        yield api_response.results
+        
+        paging = getattr(api_response, 'paging', None)
+        next_page = getattr(paging, 'next', None) if paging else None
+        if not next_page or not next_page.after:
+            return
+        after = next_page.after
+
+SEARCH_PAGE_SIZE = 200 # HubSpot maximum for search_api.do_search
+SEARCH_RESULT_CAP = 10000 # search stops paging after this many results per query
+
+def iter_modified_contact_pages(since_ms, properties=None, page_size=SEARCH_PAGE_SIZE):
+    """
+    Yields pages of contacts whose lastmodifieddate is after since_ms (epoch milliseconds),
+    oldest first, via the CRM search API. When a query reaches the search result cap the
+    search restarts from the last modification time seen, so any backlog size is covered.
+    Raises if a page fails.
+    """
+    client = get_hubspot_client()
+    properties = list(properties or CONTACT_PROPERTIES)
+    if 'lastmodifieddate' not in properties:
+        properties.append('lastmodifieddate')
+    
+    since = int(since_ms)
+    after = 0
+    while True:
+        request = PublicObjectSearchRequest(
+            filter_groups=[{"filters": [
+                {"propertyName": "lastmodifieddate", "operator": "GT", "value": str(since)}
+            ]}],
+            sorts=[{"propertyName": "lastmodifieddate", "direction": "ASCENDING"}],
+            properties=properties,
+            limit=page_size,
+            after=after
         )
-        return api_response.results
-    except Exception as e:
-        print(f"Error fetching contacts: {e}")
-        return []
+        try:
+            api_response = client.crm.contacts.search_api.do_search(public_object_search_request=request)
+        except Exception as e:
+            print(f"Error searching contacts modified since {since}: {e}")
+            raise
+        
+        results = api_response.results
+        yield results
+        
+        paging = getattr(api_response, 'paging', None)
+        next_page = getattr(paging, 'next', None) if paging else None
+        if not results or not next_page or not next_page.after:
+            return
+        after = int(next_page.after)
+        if after + page_size > SEARCH_RESULT_CAP:
+            # Start a fresh query from the newest timestamp seen so far
+            newest = contact_modified_ms(results[-1])
+            if newest is None or newest <= since:
+                print("Warning: too many contacts share one lastmodifieddate; stopping search early.")
+                return
+            since = newest - 1
+            after = 0
 
-def update_contact_property(contact_id, property_name, value):
+def contact_modified_ms(contact):
+    """A contact's lastmodifieddate as epoch milliseconds (or None if unknown)."""
+    value = (contact.properties or {}).get('lastmodifieddate')
+    if value:
+        try:
+            return int(value)
+        except ValueError:
+            parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+            return int(parsed.timestamp() * 1000)
+    updated_at = getattr(contact, 'updated_at', None)
+    if updated_at:
+        return int(updated_at.timestamp() * 1000)
+    return None
+
+BATCH_READ_SIZE = 100 # HubSpot maximum for contacts batch_api.read
+
+def get_contacts_by_ids(contact_ids, properties=None):
+    """
+    Reads many contacts by id via the batch read endpoint (100 per call).
+    Ids that no longer exist are skipped.
+    """
     client = get_hubspot_client()
+    contact_ids = [str(c) for c in contact_ids]
+    contacts = []
+    for i in range(0, len(contact_ids), BATCH_READ_SIZE):
+        batch_input = BatchReadInputSimplePublicObjectId(
+            inputs=[SimplePublicObjectId(id=contact_id) for contact_id in contact_ids[i:i + BATCH_READ_SIZE]],
+            properties=properties or CONTACT_PROPERTIES,
+            properties_with_history=[]
+        )
+        try:
+            api_response = client.crm.contacts.batch_api.read(
+                batch_read_input_simple_public_object_id=batch_input, archived=False
+            )
+            contacts.extend(api_response.results)
+        except Exception as e:
+            print(f"Error reading contacts by id: {e}")
+    return contacts
+
+def get_all_contacts(properties=None):
+    """
+    Generator over every contact in the portal (all pages), with email and name properties.
+    """
+    for page in iter_contact_pages(properties):
+        for contact in page:
+            yield contact
+
+def drop_unchanged_properties(items):
+    """
+    Removes properties whose value matches what we last pushed (within PUSH_CACHE_TTL).
+    items: list of (contact_id, {property: value}). Returns (items_to_send, skipped_count).
+    """
+    if not PUSH_CACHE_TTL or not items:
+        return items, 0
+    pushed = get_pushed_properties([contact_id for contact_id, _ in items], max_age=PUSH_CACHE_TTL)
+    to_send = []
+    skipped = 0
+    for contact_id, properties in items:
+        last = pushed.get(str(contact_id), {})
+        changed = {
+            prop: value for prop, value in properties.items()
+            if prop not in last or last[prop] != (None if value is None else str(value))
+        }
+        skipped += len(properties) - len(changed)
+        if changed:
+            to_send.append((contact_id, changed))
+    return to_send, skipped
+
+def update_contact_property(contact_id, property_name, value):
+    """
+    Returns the API response, True when HubSpot already has this value from our last
+    push (no call is made), or None on error.
+    """
     properties = {
         property_name: value
     }
+    to_send, _ = drop_unchanged_properties([(contact_id, properties)])
+    if not to_send:
+        return True
+    client = get_hubspot_client()
     try:
         simple_public_object_input = SimplePublicObjectInput(properties=properties)
         api_response = client.crm.contacts.basic_api.update(
             contact_id=contact_id,
             simple_public_object_input=simple_public_object_input
         )
+        record_pushed_properties([(contact_id, properties)])
         return api_response
     except Exception as e:
         print(f"Error updating contact {contact_id}: {e}")
         return None
+
+BATCH_UPDATE_SIZE = 100 # HubSpot maximum for contacts batch_api.update
+
+class ContactUpdateBuffer:
+    """
+    Write-behind buffer for contact property updates.
+    Updates are merged per contact (last value wins) and sent through the contacts
+    batch update endpoint, BATCH_UPDATE_SIZE contacts per call. A full batch is flushed
+    as soon as it fills up; the rest goes out on flush() or when the `with` block exits.
+    Values HubSpot already has from our last push are dropped before sending.
+
+        with ContactUpdateBuffer() as updates:
+            for lead in leads:
+                updates.add(lead['hubspot_id'], "hs_lead_status", "ATTEMPTED_TO_CONTACT")
+    """
+    def __init__(self, batch_size=BATCH_UPDATE_SIZE):
+        self.batch_size = batch_size
+        self._pending = {} # contact_id -> {property: value}, insertion ordered
+        self._lock = threading.Lock()
+        self.updated = 0
+        self.skipped = 0 # properties not sent because they were unchanged
+        self.errors = {} # contact_id -> error message
+
+    def add(self, contact_id, property_name, value):
+        self.update(contact_id, {property_name: value})
+
+    def update(self, contact_id, properties):
+        if not contact_id:
+            return
+        with self._lock:
+            self._pending.setdefault(str(contact_id), {}).update(properties)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Sends everything pending. Returns the number of contacts updated by this call."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        
+        items, skipped = drop_unchanged_properties(list(pending.items()))
+        self.skipped += skipped
+        if not items:
+            return 0
+        
+        client = get_hubspot_client()
+        updated = 0
+        for i in range(0, len(items), self.batch_size):
+            succeeded = self._send_batch(client, items[i:i + self.batch_size])
+            record_pushed_properties(succeeded)
+            updated += len(succeeded)
+        self.updated += updated
+        return updated
+
+    def _send_batch(self, client, items):
+        batch_input = BatchInputSimplePublicObjectBatchInput(inputs=[
+            SimplePublicObjectBatchInput(id=contact_id, properties=properties)
+            for contact_id, properties in items
+        ])
+        try:
+            api_response = client.crm.contacts.batch_api.update(
+                batch_input_simple_public_object_batch_input=batch_input
+            )
+        except Exception as e:
+            # One bad id rejects the whole batch: retry one by one to find which
+            print(f"Batch update of {len(items)} contacts failed ({e}); retrying individually.")
+            return self._send_individually(client, items)
+        
+        failed = set()
+        unmapped = False
+        for error in getattr(api_response, 'errors', None) or []:
+            ids = (getattr(error, 'context', None) or {}).get('ids')
+            if not ids:
+                unmapped = True
+                print(f"Error updating contacts (no ids given): {error.message}")
+                continue
+            for contact_id in ids:
+                self._record_error(contact_id, error.message)
+                failed.add(contact_id)
+        remaining = [(contact_id, properties) for contact_id, properties in items if contact_id not in failed]
+        if unmapped:
+            # Can't tell which updates were rejected: resend the rest one by one (updates are idempotent)
+            return self._send_individually(client, remaining)
+        return remaining
+
+    def _send_individually(self, client, items):
+        succeeded = []
+        for contact_id, properties in items:
+            try:
+                client.crm.contacts.basic_api.update(
+                    contact_id=contact_id,
+                    simple_public_object_input=SimplePublicObjectInput(properties=properties)
+                )
+                succeeded.append((contact_id, properties))
+            except Exception as e:
+                self._record_error(contact_id, e)
+        return succeeded
+
+    def _record_error(self, contact_id, message):
+        self.errors[contact_id] = str(message)
+        print(f"Error updating contact {contact_id}: {message}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
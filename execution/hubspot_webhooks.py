@@ -0,0 +1,152 @@
+import os
+import sys
+import hmac
+import time
+import base64
+import hashlib
+import queue
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution.db import iter_leads, delete_leads_by_email, get_archived_emails
+
+# Requests older than this are rejected (replay protection for v3 signatures)
+MAX_SIGNATURE_AGE_MS = 5 * 60 * 1000
+# Events are applied in batches: whichever comes first, a full batch or the interval
+WEBHOOK_BATCH_SIZE = int(os.getenv("HUBSPOT_WEBHOOK_BATCH_SIZE", "100"))
+WEBHOOK_FLUSH_SECONDS = float(os.getenv("HUBSPOT_WEBHOOK_FLUSH_SECONDS", "2"))
+
+UPSERT_EVENTS = ('contact.creation', 'contact.propertyChange', 'contact.restore', 'contact.merge')
+DELETE_EVENTS = ('contact.deletion', 'contact.privacyDeletion')
+# Property changes the importer cares about; others (e.g. our own hs_lead_status pushes) are ignored
+WATCHED_PROPERTIES = ('email', 'firstname', 'lastname', 'company', 'interest')
+
+def verify_signature(secret, method, url, body, headers, now_ms=None):
+    """
+    Checks a HubSpot webhook signature.
+    v3: base64 HMAC-SHA256(secret, method + url + body + timestamp), timestamp at most 5 minutes old.
+    v2: hex SHA-256 of secret + method + url + body.
+    body is the raw request body as text.
+    """
+    if not secret:
+        return False
+    signature_v3 = headers.get('X-HubSpot-Signature-v3')
+    if signature_v3:
+        timestamp = headers.get('X-HubSpot-Request-Timestamp', '')
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        if not timestamp.isdigit() or abs(now_ms - int(timestamp)) > MAX_SIGNATURE_AGE_MS:
+            return False
+        message = f"{method}{url}{body}{timestamp}".encode('utf-8')
+        expected = base64.b64encode(hmac.new(secret.encode('utf-8'), message, hashlib.sha256).digest()).decode()
+        return hmac.compare_digest(expected, signature_v3)
+
+    signature = headers.get('X-HubSpot-Signature')
+    if signature and headers.get('X-HubSpot-Signature-Version', 'v2') == 'v2':
+        expected = hashlib.sha256(f"{secret}{method}{url}{body}".encode('utf-8')).hexdigest()
+        return hmac.compare_digest(expected, signature)
+    return False
+
+def apply_events(events):
+    """
+    Applies a batch of webhook events to the local DB.
+    Created/changed contacts are re-read from HubSpot in one batch call and go through the
+    importer's diff + bulk upsert; deleted contacts are removed locally.
+    Returns (new, updated, deleted).
+    """
+    from execution.hubspot_utils import get_contacts_by_ids
+    from execution.import_leads import import_page, get_local_leads, notify_new_leads
+
+    # Latest event per contact wins (HubSpot may deliver out of order and more than once)
+    latest = {}
+    for event in sorted(events, key=lambda e: e.get('occurredAt', 0)):
+        kind = event.get('subscriptionType')
+        if kind == 'contact.propertyChange' and event.get('propertyName') not in WATCHED_PROPERTIES:
+            continue
+        if kind == 'contact.merge':
+            # The merged-away contacts no longer exist; the primary one carries on
+            primary = str(event.get('primaryObjectId') or event.get('objectId'))
+            for merged_id in event.get('mergedObjectIds') or []:
+                if str(merged_id) != primary:
+                    latest[str(merged_id)] = 'contact.deletion'
+            latest[primary] = kind
+            continue
+        object_id = event.get('objectId')
+        if object_id is not None:
+            latest[str(object_id)] = kind
+
+    deleted_ids = [object_id for object_id, kind in latest.items() if kind in DELETE_EVENTS]
+    changed_ids = [object_id for object_id, kind in latest.items() if kind in UPSERT_EVENTS]
+
+    new_leads, updated_count = [], 0
+    if changed_ids:
+        contacts = get_contacts_by_ids(changed_ids)
+        emails = [c.properties.get('email') for c in contacts if c.properties.get('email')]
+        new_leads, updated_count = import_page(
+            contacts, get_local_leads(emails), get_archived_emails(emails), set()
+        )
+        notify_new_leads(new_leads)
+
+    deleted_count = 0
+    if deleted_ids:
+        where = f"hubspot_id IN ({', '.join('?' for _ in deleted_ids)})"
+        emails = [lead['email'] for lead in iter_leads(where, deleted_ids, columns="id, email", decode=False)]
+        deleted_count = delete_leads_by_email(emails)
+
+    print(f"HubSpot webhook batch: {len(events)} events, New: {len(new_leads)}, Updated: {updated_count}, Deleted: {deleted_count}")
+    return len(new_leads), updated_count, deleted_count
+
+class WebhookEventQueue:
+    """
+    In-process queue between the webhook endpoint (which must answer HubSpot quickly)
+    and a background thread that applies events in batches.
+    Anything lost on a restart is picked up by the next import run.
+    """
+    def __init__(self, apply=apply_events, batch_size=None, flush_seconds=None):
+        self.apply = apply
+        self.batch_size = batch_size or WEBHOOK_BATCH_SIZE
+        self.flush_seconds = WEBHOOK_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, events):
+        for event in events:
+            self._queue.put(event)
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        # Started lazily so a forking server (gunicorn) starts one per worker process
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="hubspot-webhooks", daemon=True)
+                self._worker.start()
+
+    def next_batch(self, timeout=None):
+        """Blocks for the first event, then collects more until the batch is full or flush_seconds pass."""
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                self.apply(batch)
+            except Exception as e:
+                print(f"Error applying HubSpot webhook batch ({len(batch)} events): {e}")
+
+webhook_queue = WebhookEventQueue()
@@ -1,52 +1,45 @@
 import os
 import sys
-import json
+import time
 
 # Add parent dir to path to import notifications
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from execution.hubspot_utils import get_hubspot_client, get_all_contacts
-from execution.db import add_lead, get_lead_by_email, update_lead_hubspot_id, get_db_connection, execute_query
+from execution.hubspot_utils import get_hubspot_client, iter_contact_pages, iter_modified_contact_pages, contact_modified_ms
+from execution.db import bulk_upsert_leads, delete_leads_by_email, get_archived_emails, iter_leads, get_sync_state, set_sync_state
 from execution.name_utils import normalize_name
 from dotenv import load_dotenv
 
+# Incremental imports only pull contacts modified since the watermark; a full
+# reconciliation (which also handles deletions) runs on this slower schedule.
+FULL_SYNC_INTERVAL = float(os.getenv("IMPORT_FULL_SYNC_HOURS", "24")) * 3600
+# Re-read a small window before the watermark to absorb HubSpot indexing lag
+WATERMARK_OVERLAP_MS = int(os.getenv("IMPORT_WATERMARK_OVERLAP_SECONDS", "300")) * 1000
+
+WATERMARK_KEY = 'hubspot_import_watermark'
+FULL_SYNC_KEY = 'hubspot_import_full_sync_at'
+
+LOCAL_LEAD_COLUMNS = "id, email, hubspot_id, name, metadata"
+
 def get_all_local_leads():
-    conn = get_db_connection()
-    cursor = execute_query(conn, "SELECT id, email, hubspot_id, name, metadata FROM leads")
-    rows = cursor.fetchall()
-    conn.close()
-    
-    # Parse metadata JSON
-    leads = {}
-    for row in rows:
-        d = dict(row)
-        if isinstance(d['metadata'], str):
-            try:
-                d['metadata'] = json.loads(d['metadata'])
-            except:
-                d['metadata'] = {}
-        leads[d['email']] = d
-    return leads
+    # Streamed page by page; only the columns the diff needs
+    return {lead['email']: lead for lead in iter_leads(columns=LOCAL_LEAD_COLUMNS)}
 
-def delete_local_lead(email):
-    conn = get_db_connection()
-    execute_query(conn, "DELETE FROM leads WHERE email = ?", (email,))
-    conn.commit()
-    conn.close()
-    print(f"  Deleted local lead: {email} (Removed from HubSpot)")
+def get_local_leads(emails):
+    """Local leads for just the given emails (one page of HubSpot contacts)."""
+    emails = list(emails)
+    if not emails:
+        return {}
+    where = f"email IN ({', '.join('?' for _ in emails)})"
+    return {lead['email']: lead for lead in iter_leads(where, emails, columns=LOCAL_LEAD_COLUMNS)}
 
-def main():
-    print("--- Importing Leads from HubSpot ---")
-    
-    contacts = get_all_contacts()
-    print(f"Fetched {len(contacts)} contacts from HubSpot.")
-    
-    local_leads_map = get_all_local_leads()
-    hubspot_emails = set()
-    
-    new_count = 0
-    updated_count = 0
-    deleted_count = 0
+def import_page(contacts, local_leads_map, archived_emails, hubspot_emails):
+    """
+    Diffs one HubSpot page against the local leads and writes it in a single bulk upsert.
+    Records every email seen in hubspot_emails. Returns (new_leads, updated_count).
+    """
+    upserts = []
+    new_leads = []
     
     for contact in contacts:
         email = contact.properties.get('email')
@@ -54,6 +47,8 @@ def main():
             continue
         
         hubspot_emails.add(email)
+        if email in archived_emails:
+            continue
         
         firstname = contact.properties.get('firstname', '')
         lastname = contact.properties.get('lastname', '')
@@ -70,84 +65,163 @@ def main():
         if local_lead:
             # Intelligent Sync: Check for updates
             updates_needed = False
+            metadata_changes = {}
             
             # 1. Check HubSpot ID
             if not local_lead.get('hubspot_id'):
-                update_lead_hubspot_id(local_lead['id'], hubspot_id)
                 updates_needed = True
                 
             # 3. Check Company Change
             local_company = local_lead.get('metadata', {}).get('company', '')
             if company and local_company != company:
                 print(f"  Updating company for {email}: {local_company} -> {company}")
-                
-                metadata = local_lead.get('metadata', {})
-                metadata['company'] = company
-                
-                conn = get_db_connection()
-                execute_query(conn, "UPDATE leads SET metadata = ? WHERE email = ?", (json.dumps(metadata), email))
-                conn.commit()
-                conn.close()
+                metadata_changes['company'] = company
                 updates_needed = True
 
             # 4. Check Interest Change
             local_interest = local_lead.get('metadata', {}).get('interest', '')
             if interest and local_interest != interest:
                 print(f"  Updating interest for {email}: {local_interest} -> {interest}")
-                
-                metadata = local_lead.get('metadata', {})
-                metadata['interest'] = interest
-                
-                conn = get_db_connection()
-                execute_query(conn, "UPDATE leads SET metadata = ? WHERE email = ?", (json.dumps(metadata), email))
-                conn.commit()
-                conn.close()
+                metadata_changes['interest'] = interest
                 updates_needed = True
                 
             # 2. Check Name Change (Simple check)
             if local_lead.get('name') != name:
                 print(f"  Updating name for {email}: {local_lead.get('name')} -> {name}")
-                # Update name in DB
-                conn = get_db_connection()
-                execute_query(conn, "UPDATE leads SET name = ? WHERE email = ?", (name, email))
-                conn.commit()
-                conn.close()
                 updates_needed = True
             
             if updates_needed:
-                updated_count += 1
+                # Only changed metadata keys are merged; sequence state is left untouched
+                upserts.append({
+                    "email": email,
+                    "name": name,
+                    "hubspot_id": hubspot_id,
+                    "metadata": metadata_changes
+                })
         else:
             # Add new lead
             print(f"  Importing new lead: {email}")
-            lead_data = {
+            upserts.append({
                 "email": email,
                 "name": name,
                 "source": "HubSpot Import",
+                "hubspot_id": hubspot_id,
                 "metadata": {
                     "sequence_stage": 0, # Start at beginning
                     "company": company,
                     "interest": interest,
                     "imported_at": str(os.times())
                 }
-            }
-            
-            new_id = add_lead(lead_data)
-            if new_id:
-                update_lead_hubspot_id(new_id, hubspot_id)
-                new_count += 1
-                
-                # Notify Slack via Notifier
-                from notifications.slack_notifier import notifier
-                notifier.send_message(f":new: New Lead Imported: *{name}* ({email})")
+            })
+            new_leads.append((name, email))
+        
+    bulk_upsert_leads(upserts)
+    return new_leads, len(upserts) - len(new_leads)
+
+def notify_new_leads(new_leads):
+    # Notify Slack via Notifier
+    if new_leads:
+        from notifications.slack_notifier import notifier
+        for name, email in new_leads:
+            notifier.send_message(f":new: New Lead Imported: *{name}* ({email})")
+
+def needs_full_sync():
+    if get_sync_state(WATERMARK_KEY) is None:
+        return True
+    last_full = get_sync_state(FULL_SYNC_KEY)
+    return last_full is None or time.time() - float(last_full) >= FULL_SYNC_INTERVAL
+
+def full_import():
+    """Downloads every contact, diffs it against every local lead and removes deleted ones."""
+    print("Mode: full reconciliation")
+    started_ms = int(time.time() * 1000)
+    
+    local_leads_map = get_all_local_leads()
+    # Archived (terminal) leads are known: don't re-import them as new
+    archived_emails = get_archived_emails()
+    hubspot_emails = set()
+    
+    new_leads = []
+    updated_count = 0
+    fetched = 0
+    fetch_complete = True
+    
+    # Process contacts page by page as HubSpot returns them (one transaction per page)
+    try:
+        for page in iter_contact_pages():
+            fetched += len(page)
+            page_new, page_updated = import_page(page, local_leads_map, archived_emails, hubspot_emails)
+            new_leads.extend(page_new)
+            updated_count += page_updated
+    except Exception as e:
+        print(f"HubSpot fetch interrupted after {fetched} contacts: {e}")
+        fetch_complete = False
+    
+    print(f"Fetched {fetched} contacts from HubSpot.")
+    notify_new_leads(new_leads)
                 
     # Handle Deletions
     # If a lead is in local_leads_map but NOT in hubspot_emails, delete it.
-    for email in local_leads_map:
-        if email not in hubspot_emails:
-            delete_local_lead(email)
-            deleted_count += 1
+    # Only safe when every page was fetched; a partial fetch would look like mass deletion.
+    if fetch_complete:
+        to_delete = [email for email in local_leads_map if email not in hubspot_emails]
+    else:
+        print("Skipping deletions: HubSpot contact list is incomplete.")
+        to_delete = []
+    deleted_count = delete_leads_by_email(to_delete)
+    for email in to_delete:
+        print(f"  Deleted local lead: {email} (Removed from HubSpot)")
+    
+    if fetch_complete:
+        # Everything modified before this run started is now reflected locally
+        set_sync_state(WATERMARK_KEY, started_ms)
+        set_sync_state(FULL_SYNC_KEY, time.time())
                 
-    print(f"Import Complete. New: {new_count}, Updated: {updated_count}, Deleted: {deleted_count}")
+    print(f"Import Complete. New: {len(new_leads)}, Updated: {updated_count}, Deleted: {deleted_count}")
+
+def incremental_import():
+    """Pulls only contacts modified since the stored watermark (no deletion pass)."""
+    watermark = int(get_sync_state(WATERMARK_KEY))
+    print(f"Mode: incremental (modified since {watermark})")
+    
+    new_leads = []
+    updated_count = 0
+    fetched = 0
+    
+    try:
+        for page in iter_modified_contact_pages(watermark - WATERMARK_OVERLAP_MS):
+            if not page:
+                continue
+            fetched += len(page)
+            emails = [c.properties.get('email') for c in page if c.properties.get('email')]
+            page_new, page_updated = import_page(
+                page, get_local_leads(emails), get_archived_emails(emails), set()
+            )
+            new_leads.extend(page_new)
+            updated_count += page_updated
+            
+            # Pages come oldest first, so progress can be saved page by page
+            newest = max((contact_modified_ms(c) or 0) for c in page)
+            if newest > watermark:
+                watermark = newest
+                set_sync_state(WATERMARK_KEY, watermark)
+    except Exception as e:
+        print(f"HubSpot search interrupted after {fetched} contacts: {e}")
+    
+    print(f"Fetched {fetched} modified contacts from HubSpot.")
+    notify_new_leads(new_leads)
+    print(f"Import Complete. New: {len(new_leads)}, Updated: {updated_count}, Deleted: 0 (next full sync handles deletions)")
+
+def main(full=None):
+    print("--- Importing Leads from HubSpot ---")
+    
+    if full is None:
+        full = '--full' in sys.argv or needs_full_sync()
+    
+    if full:
+        full_import()
+    else:
+        incremental_import()
 
 if __name__ == '__main__':
     main()
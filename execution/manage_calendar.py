@@ -4,11 +4,15 @@ import datetime
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution.google_services import get_google_service
 
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
-def get_service():
+def get_calendar_credentials():
     creds = None
     token_path = os.path.join(os.path.dirname(__file__), '../token.json')
     creds_path = os.path.join(os.path.dirname(__file__), '../credentials.json')
@@ -28,7 +32,10 @@ def get_service():
         with open(token_path, 'w') as token:
             token.write(creds.to_json())
 
-    return build('calendar', 'v3', credentials=creds)
+    return creds
+
+def get_service():
+    return get_google_service('calendar', 'v3', credentials_loader=get_calendar_credentials)
 
 def check_availability(service, time_min, time_max):
     print(f"Checking availability from {time_min} to {time_max}...")
@@ -6,12 +6,13 @@ import sys
 # Add parent dir to path to import notifications
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from execution.db import get_db_connection
+from execution.db import iter_active_leads, get_due_leads, patch_leads_metadata
 from execution.send_email import create_draft, get_service, send_message
 from execution.analyze_intent import analyze_lead
 from execution.sync_crm import sync_event
 from dotenv import load_dotenv
-from execution.hubspot_utils import update_contact_property
+from execution.hubspot_utils import ContactUpdateBuffer
+from execution.send_pipeline import BatchingStage, MailboxLimiter, run_send_pipeline
 from jinja2 import Template
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
@@ -20,24 +21,14 @@ from openai import OpenAI
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+# The daemon may run every few minutes; an unanswered proposal is only re-sent this often
+PROPOSAL_INTERVAL = 43200 # 12 hours
+
 def get_active_leads():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    # Fetch leads that are not disqualified or converted
-    cursor.execute("SELECT * FROM leads WHERE status NOT IN ('disqualified', 'converted', 'unsubscribed')")
-    rows = cursor.fetchall()
-    conn.close()
-    
-    leads = []
-    for row in rows:
-        lead = dict(row)
-        if lead.get('metadata') and isinstance(lead['metadata'], str):
-            try:
-                lead['metadata'] = json.loads(lead['metadata'])
-            except:
-                lead['metadata'] = {}
-        leads.append(lead)
-    return leads
+    """
+    Streams leads that are not disqualified, converted or unsubscribed (generator).
+    """
+    return iter_active_leads()
 
 from jinja2 import Template
 
@@ -122,47 +113,18 @@ def generate_email_content(lead, stage):
 
 def get_leads_by_stage():
     """
-    Returns a dict: {stage_int: [lead_dict, ...]}
+    Returns a dict: {(next_stage, interest): [lead_dict, ...]}
+    Suppression and cadence rules are applied in SQL (see db.get_due_leads).
     """
-    leads = get_active_leads()
     grouped = {}
     
-    for lead in leads:
-        # Check suppression rules first
-        metadata = lead.get('metadata', {})
-        
-        if lead.get('status') in ['converted', 'disqualified', 'unsubscribed']:
-            continue
-        if metadata.get('do_not_contact') or metadata.get('meeting_booked') or metadata.get('has_replied'):
-            continue
-            
-        current_stage = metadata.get('sequence_stage', 0)
-        last_contacted_str = metadata.get('last_contacted_at')
+    for lead in get_due_leads():
+        next_stage = lead['sequence_stage'] + 1
+        key = (next_stage, lead['interest'])
         
-        # Determine if actionable
-        should_email = False
-        next_stage = current_stage + 1
-        
-        if current_stage == 0:
-            should_email = True 
-        elif last_contacted_str:
-            last_contacted = datetime.datetime.fromisoformat(last_contacted_str)
-            days_since = (datetime.datetime.now() - last_contacted).days
-            
-            if current_stage == 1 and days_since >= 2:
-                should_email = True
-            elif current_stage == 2 and days_since >= 4:
-                should_email = True
-            elif current_stage == 3 and days_since >= 5:
-                should_email = True
-        
-        if should_email and next_stage <= 4:
-            interest = metadata.get('interest', 'general')
-            key = (next_stage, interest)
-            
-            if key not in grouped:
-                grouped[key] = []
-            grouped[key].append(lead)
+        if key not in grouped:
+            grouped[key] = []
+        grouped[key].append(lead)
             
     return grouped
 
@@ -213,6 +175,28 @@ def generate_generic_stage_content(stage, interest="general", feedback=None):
         print(f"Error generating generic content: {e}")
         return None
 
+def get_batch_id(stage, interest):
+    # Sanitize interest for filename
+    safe_interest = interest.replace(" ", "_").lower()
+    return f"{stage}_{safe_interest}"
+
+def has_pending_proposal(batch_id, now=None):
+    """
+    True while a template proposal for this batch is awaiting a decision in Slack
+    (not yet blasted and proposed less than PROPOSAL_INTERVAL ago).
+    """
+    filename = f"batch_{batch_id}.json"
+    try:
+        with open(filename, "r") as f:
+            batch_data = json.load(f)
+        proposed_at = batch_data.get('proposed_at') or os.path.getmtime(filename)
+    except (OSError, ValueError):
+        return False
+    if batch_data.get('status') == 'sent':
+        return False
+    now = datetime.datetime.now().timestamp() if now is None else now
+    return now - proposed_at < PROPOSAL_INTERVAL
+
 def request_stage_approval(stage, interest, content, lead_count):
     """
     Sends a Slack message proposing the template for the batch.
@@ -222,16 +206,15 @@ def request_stage_approval(stage, interest, content, lead_count):
     # Save content to a temporary file/cache for the server to pick up?
     # Actually, we can embed it in the button value if small, or save to a file.
     # Saving to a file `batch_stage_{stage}_{interest}.json` is safest.
-    # Sanitize interest for filename
-    safe_interest = interest.replace(" ", "_").lower()
-    batch_id = f"{stage}_{safe_interest}"
+    batch_id = get_batch_id(stage, interest)
     
     batch_data = {
         "stage": stage,
         "interest": interest,
         "content": content,
         "lead_count": lead_count,
-        "status": "pending_template"
+        "status": "pending_template",
+        "proposed_at": datetime.datetime.now().timestamp()
     }
     
     with open(f"batch_{batch_id}.json", "w") as f:
@@ -403,8 +386,11 @@ def execute_batch_blast(batch_id):
     leads_by_group = get_leads_by_stage()
     leads = leads_by_group.get((stage, interest), [])
     
-    sent_count = 0
     service = get_service()
+    try:
+        mailbox = service.users().getProfile(userId='me').execute()['emailAddress']
+    except Exception:
+        mailbox = 'me'
     
     template_path = os.path.join(os.path.dirname(__file__), '../templates/universal_template.html')
     with open(template_path, 'r') as f:
@@ -420,47 +406,69 @@ def execute_batch_blast(batch_id):
         text = text.replace("{{company}}", company).replace("{company}", company)
         return text
 
-    for lead in leads:
-        try:
-            html_body = template.render(
-                subject=content['subject'],
-                name=lead.get('name', 'there'),
-                personalized_hook=fill(content['personalized_hook'], lead),
-                value_proposition=fill(content['value_proposition'], lead),
-                cta_text=fill(content['cta_text'], lead),
-                my_name="Arnold", 
-                my_title="Founder",
-                my_website="https://quartier-digital.com",
-                unsubscribe_link="#"
-            )
-            
-            send_message(service, "me", lead['email'], content['subject'], html_body)
-            
-            # Update DB
-            metadata = lead.get('metadata', {})
-            if isinstance(metadata, str): metadata = json.loads(metadata)
-            
-            metadata['sequence_stage'] = stage
-            metadata['last_contacted_at'] = datetime.datetime.now().isoformat()
-            
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE leads SET metadata = ? WHERE id = ?", (json.dumps(metadata), lead['id']))
-            conn.commit()
-            conn.close()
-            
-            # Update HubSpot
-            hubspot_status = "ATTEMPTED_TO_CONTACT"
-            if stage == 4: hubspot_status = "UNQUALIFIED"
-            if lead.get('hubspot_id'):
-                 update_contact_property(lead['hubspot_id'], "hs_lead_status", hubspot_status)
-            
-            sent_count += 1
-            print(f"  Sent to {lead['email']}")
-            
-        except Exception as e:
-            print(f"  Failed to send to {lead['email']}: {e}")
-            
+    hubspot_status = "ATTEMPTED_TO_CONTACT"
+    if stage == 4: hubspot_status = "UNQUALIFIED"
+    
+    hubspot_updates = ContactUpdateBuffer()
+    
+    def push_statuses(batch):
+        # The buffer sends full batches of BATCH_UPDATE_SIZE itself; the rest is flushed after the run
+        for contact_id, property_name, value in batch:
+            hubspot_updates.add(contact_id, property_name, value)
+    
+    # Senders only send; DB and HubSpot writes are batched by their own stages
+    db_stage = BatchingStage("blast-db", lambda batch: patch_leads_metadata(dict(batch)))
+    crm_stage = BatchingStage("blast-crm", push_statuses)
+    
+    def send_one(lead):
+        html_body = template.render(
+            subject=content['subject'],
+            name=lead.get('name', 'there'),
+            personalized_hook=fill(content['personalized_hook'], lead),
+            value_proposition=fill(content['value_proposition'], lead),
+            cta_text=fill(content['cta_text'], lead),
+            my_name="Arnold", 
+            my_title="Founder",
+            my_website="https://quartier-digital.com",
+            unsubscribe_link="#"
+        )
+        
+        # get_service() is cached per worker thread
+        if not send_message(get_service(), "me", lead['email'], content['subject'], html_body):
+            print(f"  Failed to send to {lead['email']}")
+            return False
+        
+        # Update DB (server-side merge, only the changed keys)
+        db_stage.put((lead['id'], {
+            'sequence_stage': stage,
+            'last_contacted_at': datetime.datetime.now().isoformat()
+        }))
+        
+        # Update HubSpot
+        if lead.get('hubspot_id'):
+            crm_stage.put((lead['hubspot_id'], "hs_lead_status", hubspot_status))
+        
+        print(f"  Sent to {lead['email']}")
+        return True
+    
+    limiter = MailboxLimiter(mailbox)
+    try:
+        stats = run_send_pipeline(leads, send_one, limiter)
+    finally:
+        # Drain both stages so every sent email is recorded
+        db_stage.close()
+        crm_stage.close()
+        hubspot_updates.flush()
+    
+    print(f"Blast summary: {stats.summary(limiter)}")
+    print(f"HubSpot: {hubspot_updates.updated} contacts updated, {hubspot_updates.skipped} unchanged values skipped, {len(hubspot_updates.errors)} failed.")
+    sent_count = stats.sent
+    
+    # The group can be proposed again once new leads come due
+    batch_data['status'] = 'sent'
+    with open(f"batch_{batch_id}.json", "w") as f:
+        json.dump(batch_data, f)
+    
     # Cleanup Sample Draft
     sample_draft_id = batch_data.get('sample_draft_id')
     if sample_draft_id:
@@ -485,6 +493,10 @@ def main():
         stage, interest = key
         print(f"Stage {stage} ({interest}): {len(leads)} leads found.")
         
+        if has_pending_proposal(get_batch_id(stage, interest)):
+            print("  Template already awaiting approval in Slack; not proposing again.")
+            continue
+        
         # Generate Generic Content
         content = generate_generic_stage_content(stage, interest)
         if content:
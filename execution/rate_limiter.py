@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import random
+import atexit
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution.db import reserve_rate_limit_token
+
+# Retries for throttled (429) and transient (5xx) responses
+MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "5"))
+BACKOFF_BASE = float(os.getenv("RATE_LIMIT_BACKOFF_SECONDS", "1"))
+BACKOFF_MAX = 60.0
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# For non-idempotent calls: a 429 was rejected before anything happened, a 5xx may not have been
+THROTTLED_STATUSES = {429}
+
+class ThrottleStats:
+    """Per-process counters: how long we waited on the limiter and on Retry-After."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.throttled_calls = 0
+        self.throttle_seconds = 0.0
+        self.retries = 0
+
+    def record(self, waited=0.0, retried=False):
+        with self._lock:
+            if waited > 0:
+                self.throttled_calls += 1
+                self.throttle_seconds += waited
+            if retried:
+                self.retries += 1
+
+    def count_call(self):
+        with self._lock:
+            self.calls += 1
+
+    def summary(self):
+        return (f"{self.calls} calls, {self.throttled_calls} throttled, "
+                f"{self.throttle_seconds:.1f}s waiting, {self.retries} retries")
+
+class TokenBucket:
+    """
+    Paces calls to `limit` requests per `window` seconds across all threads and processes
+    sharing the local database (the bucket state lives in the rate_limits table).
+    90% of the limit is spread evenly over the window and 10% is allowed as a burst, so
+    no window can exceed the limit.
+    """
+    def __init__(self, name, limit, window):
+        self.name = name
+        self.rate = 0.9 * limit / window
+        self.capacity = max(1.0, 0.1 * limit)
+
+    def acquire(self):
+        """Blocks until a call is allowed. Returns the seconds spent waiting."""
+        wait = reserve_rate_limit_token(self.name, self.rate, self.capacity)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+def _retry_after(error):
+    headers = getattr(error, 'headers', None) or {}
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def call_with_retry(func, *args, buckets=(), stats=None, retry_statuses=RETRYABLE_STATUSES, **kwargs):
+    """
+    Calls func after taking a token from every bucket. On a status in retry_statuses
+    (429/5xx by default) it waits for Retry-After (or an exponential backoff) plus jitter
+    and tries again, up to MAX_RETRIES.
+    Other errors, and the last failure, are raised to the caller.
+    """
+    attempt = 0
+    while True:
+        waited = sum(bucket.acquire() for bucket in buckets)
+        if stats:
+            stats.count_call()
+            stats.record(waited)
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            status = getattr(e, 'status', None)
+            if status not in retry_statuses or attempt >= MAX_RETRIES:
+                raise
+            delay = _retry_after(e)
+            if delay is None:
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+            delay += random.uniform(0, BACKOFF_BASE)
+            attempt += 1
+            print(f"Rate limited or unavailable (HTTP {status}); retry {attempt}/{MAX_RETRIES} in {delay:.1f}s")
+            if stats:
+                stats.record(delay, retried=True)
+            time.sleep(delay)
+
+def report_at_exit(label, stats):
+    """Prints the throttle metrics when the process ends (only if any calls were made)."""
+    def report():
+        if stats.calls:
+            print(f"{label} rate limiter: {stats.summary()}")
+    atexit.register(report)
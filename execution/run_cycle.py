@@ -20,6 +20,9 @@ def main():
     print("=== Starting Slack Control Center Cycle ===")
     print("Note: Ensure 'interface/slack_server.py' is running and exposed via ngrok.")
     
+    # 0. Move converted / disqualified / unsubscribed leads to the archive tables
+    run_script("archive_leads.py")
+    
     # 1. Import new leads from HubSpot
     run_script("import_leads.py")
     
@@ -7,6 +7,9 @@ import os
 # Add parent dir to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+CYCLE_INTERVAL = 43200 # 12 hours
+MIN_SLEEP = 300 # Don't spin faster than every 5 minutes
+
 def run_cycle():
     print(f"\n[{datetime.datetime.now()}] Starting Cycle...")
     try:
@@ -18,17 +21,34 @@ def run_cycle():
     except Exception as e:
         print(f"Failed to run cycle: {e}")
 
+def seconds_until_next_cycle():
+    """
+    Seconds to sleep until the next lead becomes due, capped at the regular 12 hour interval.
+    """
+    try:
+        from execution.db import get_next_due_at
+        next_due = get_next_due_at()
+    except Exception as e:
+        print(f"Could not read next due lead: {e}")
+        return CYCLE_INTERVAL
+
+    if not next_due:
+        return CYCLE_INTERVAL
+    wait = (next_due - datetime.datetime.now()).total_seconds()
+    return int(min(CYCLE_INTERVAL, max(MIN_SLEEP, wait)))
+
 def main():
     print("=== AI Follow-Up Daemon Started ===")
-    print("Running cycle every 12 hours (43200 seconds).")
+    print(f"Running cycle when the next lead is due (at most every {CYCLE_INTERVAL} seconds).")
     print("Press Ctrl+C to stop.")
     
     while True:
         run_cycle()
         
-        print(f"[{datetime.datetime.now()}] Cycle finished. Sleeping for 12 hours...")
+        sleep_for = seconds_until_next_cycle()
+        print(f"[{datetime.datetime.now()}] Cycle finished. Sleeping for {sleep_for} seconds...")
         try:
-            time.sleep(43200) # 12 hours
+            time.sleep(sleep_for)
         except KeyboardInterrupt:
             print("\nDaemon stopped by user.")
             break
@@ -19,6 +19,9 @@ def run_script(script_name):
 def main():
     print("=== Starting Daily Automation Workflow ===")
     
+    # 0. Move converted / disqualified / unsubscribed leads to the archive tables
+    run_script("archive_leads.py")
+    
     # 1. Import new leads from HubSpot
     run_script("import_leads.py")
     
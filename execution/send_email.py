@@ -3,16 +3,15 @@ import base64
 import sys
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from execution.google_auth import get_credentials
+from execution.google_services import get_google_service
 
 # Add parent dir to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 def get_service():
-    creds = get_credentials()
-    return build('gmail', 'v1', credentials=creds)
+    # Cached per thread; built once from the bundled discovery document
+    return get_google_service('gmail', 'v1')
 
 def send_message(service, sender, to, subject, message_text, content_type='html'):
     message = MIMEText(message_text, content_type)
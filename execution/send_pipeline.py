@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+import datetime
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution.db import consume_daily_quota, refund_daily_quota
+from execution.rate_limiter import TokenBucket
+
+# Parallel senders; each thread gets its own Gmail service (httplib2 is not thread-safe)
+BLAST_WORKERS = int(os.getenv("BLAST_WORKERS", "4"))
+# Per-mailbox pacing and Gmail's daily sending limit (2,000 for Workspace, 500 for consumer accounts)
+GMAIL_SENDS_PER_SECOND = float(os.getenv("GMAIL_SENDS_PER_SECOND", "2"))
+GMAIL_DAILY_SEND_LIMIT = int(os.getenv("GMAIL_DAILY_SEND_LIMIT", "2000"))
+# DB / CRM stages flush when this many results are queued or after the interval
+STAGE_BATCH_SIZE = int(os.getenv("BLAST_STAGE_BATCH_SIZE", "50"))
+# About the time it takes to fill a batch at the send rate, so flushes carry full batches
+STAGE_FLUSH_SECONDS = min(30.0, STAGE_BATCH_SIZE / GMAIL_SENDS_PER_SECOND)
+
+_STOP = object()
+
+class BatchingStage:
+    """
+    A background thread that receives items from the senders and hands them to
+    `flush` as lists (full batch or every flush_seconds), so slow DB/CRM writes never
+    hold up a send. close() drains whatever is left and waits for the thread.
+    """
+    def __init__(self, name, flush, batch_size=None, flush_seconds=STAGE_FLUSH_SECONDS):
+        self.name = name
+        self.flush = flush
+        self.batch_size = batch_size or STAGE_BATCH_SIZE
+        self.flush_seconds = flush_seconds
+        self.processed = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, item):
+        self._queue.put(item)
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _flush(self, batch):
+        try:
+            self.flush(batch)
+            self.processed += len(batch)
+        except Exception as e:
+            print(f"Error in {self.name} stage ({len(batch)} items): {e}")
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                if batch:
+                    self._flush(batch)
+                return
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_seconds
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+class MailboxLimiter:
+    """
+    Paces sends from one mailbox across threads and processes (token bucket in the DB)
+    and enforces the mailbox's daily quota (daily_quotas table).
+    """
+    def __init__(self, mailbox, per_second=None, daily_limit=None):
+        self.mailbox = mailbox
+        self.quota_name = f"gmail_send:{mailbox}"
+        self.daily_limit = daily_limit or GMAIL_DAILY_SEND_LIMIT
+        self.bucket = TokenBucket(f"gmail_send:{mailbox}", per_second or GMAIL_SENDS_PER_SECOND, 1)
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Waits for a send slot. Returns the quota day the slot was taken from (pass it to
+        refund() if the send fails), or None once today's quota is used up.
+        """
+        day = datetime.date.today().isoformat()
+        if not consume_daily_quota(self.quota_name, self.daily_limit, day=day):
+            return None
+        waited = self.bucket.acquire()
+        with self._lock:
+            self.waited += waited
+        return day
+
+    def refund(self, day):
+        """Returns an unused slot to the daily quota."""
+        refund_daily_quota(self.quota_name, day)
+
+class SendStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0 # not attempted (daily quota reached)
+
+    def add(self, outcome):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def summary(self, limiter=None):
+        elapsed = time.monotonic() - self.started
+        rate = self.sent / elapsed if elapsed > 0 else 0.0
+        text = (f"Sent {self.sent}, failed {self.failed}, skipped {self.skipped} "
+                f"in {elapsed:.1f}s ({rate:.2f} emails/s)")
+        if limiter:
+            text += f"; {limiter.waited:.1f}s waiting on the send limiter"
+        return text
+
+def run_send_pipeline(items, send_one, limiter, workers=None):
+    """
+    Sends items on a bounded worker pool. For each item a worker waits for the
+    limiter and calls send_one(item), which returns True when the email went out;
+    failed sends give their quota slot back. Once the daily quota is exhausted the
+    remaining items are skipped.
+    Returns SendStats.
+    """
+    stats = SendStats()
+    quota_exhausted = threading.Event()
+
+    def worker(item):
+        day = None if quota_exhausted.is_set() else limiter.acquire()
+        if not day:
+            quota_exhausted.set()
+            stats.add('skipped')
+            return
+        try:
+            sent = send_one(item)
+        except Exception as e:
+            print(f"  Send failed: {e}")
+            sent = False
+        if not sent:
+            # Failed sends don't count against the mailbox's daily limit
+            limiter.refund(day)
+        stats.add('sent' if sent else 'failed')
+
+    with ThreadPoolExecutor(max_workers=workers or BLAST_WORKERS, thread_name_prefix="blast") as pool:
+        for _ in pool.map(worker, items):
+            pass
+
+    if quota_exhausted.is_set():
+        print(f"Daily send limit ({limiter.daily_limit}) reached for {limiter.mailbox}; {stats.skipped} emails not sent.")
+    return stats
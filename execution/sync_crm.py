@@ -1,22 +1,27 @@
 import sys
 import json
 import os
+import atexit
 
 # Add parent dir to path if running directly or imported
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from dotenv import load_dotenv
 from execution.db import get_lead_by_email
-from execution.hubspot_utils import log_note
+from execution.hubspot_utils import NoteBuffer
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
 
 # from hubspot import HubSpot
 
 
+# Events queued during a cycle; one note per contact is created on flush
+pending_notes = NoteBuffer()
+
 def sync_event(event_type, data):
     """
-    Syncs an event to HubSpot as a Note.
+    Queues an event to be synced to HubSpot as a Note.
+    Call flush_events() at the end of a loop (it also runs at interpreter exit).
     """
     email = data.get('email')
     if not email:
@@ -29,16 +34,19 @@ def sync_event(event_type, data):
         return
 
     note_body = f"Event: {event_type}\nData: {json.dumps(data, indent=2)}"
-    
+    pending_notes.add(lead['hubspot_id'], note_body)
+
+def flush_events():
+    """Creates the queued notes in HubSpot (batched, one per contact)."""
     try:
-        note_id = log_note(lead['hubspot_id'], note_body)
-        if note_id:
-            print(f"Logged note to HubSpot for {email}. Note ID: {note_id}")
-        else:
-            print(f"Failed to log note for {email}")
+        created = pending_notes.flush()
+        if created:
+            print(f"Logged {created} notes to HubSpot.")
     except Exception as e:
         print(f"Error syncing to CRM: {e}")
 
+atexit.register(flush_events)
+
 def main():
     if len(sys.argv) < 3:
         print("Usage: python sync_crm.py <event_type> <json_data>")
@@ -53,6 +61,7 @@ def main():
 
     try:
         sync_event(event_type, data)
+        flush_events()
     except Exception as e:
         print(f"Failed to sync to CRM: {e}")
         sys.exit(1)
@@ -8,51 +8,52 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from openai import OpenAI
 from dotenv import load_dotenv
-from hubspot_utils import get_hubspot_client, update_contact_property, get_all_contacts
+from hubspot_utils import ContactUpdateBuffer
 from send_email import get_service
-from db import get_db_connection
+from db import iter_leads, patch_lead_metadata, get_sync_state, set_sync_state
+from gmail_history import (
+    HISTORY_STATE_KEY, HistoryExpired, get_current_history_id,
+    list_added_message_ids, latest_messages_by_lead, header
+)
+from gmail_batch import get_messages, METADATA_HEADERS
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-def get_latest_email_content(service, email_address):
-    """
-    Searches for the latest email thread with the given address.
-    Returns the content of the last message.
-    """
+def find_latest_message_id(service, email_address):
+    """Id of the newest message from or to the given address (or None)."""
     try:
         # Search for messages from or to the email
         query = f"from:{email_address} OR to:{email_address}"
         results = service.users().messages().list(userId='me', q=query, maxResults=1).execute()
         messages = results.get('messages', [])
-        
-        if not messages:
-            return None
-            
-        # Get full message details
-        msg_id = messages[0]['id']
-        message = service.users().messages().get(userId='me', id=msg_id).execute()
-        
-        # Extract snippet or body
-        snippet = message.get('snippet', '')
-        
-        # Check if it was sent BY the lead (incoming)
-        headers = message['payload']['headers']
-        sender = next((h['value'] for h in headers if h['name'] == 'From'), '')
-        
-        is_from_lead = email_address.lower() in sender.lower()
-        
-        return {
-            "content": snippet,
-            "is_from_lead": is_from_lead,
-            "date": next((h['value'] for h in headers if h['name'] == 'Date'), '')
-        }
-        
+        return messages[0]['id'] if messages else None
     except Exception as e:
         print(f"Error checking Gmail for {email_address}: {e}")
         return None
 
+def summarize_message(message, email_address):
+    # Snippet is enough for the status analysis; headers tell us who sent it
+    sender = header(message, 'From')
+    return {
+        "content": message.get('snippet', ''),
+        # Check if it was sent BY the lead (incoming)
+        "is_from_lead": email_address.lower() in sender.lower(),
+        "date": header(message, 'Date')
+    }
+
+def get_latest_email_content(service, email_address):
+    """
+    Searches for the latest email thread with the given address.
+    Returns the content of the last message.
+    """
+    msg_id = find_latest_message_id(service, email_address)
+    if not msg_id:
+        return None
+    message = get_messages(service, [msg_id]).get(msg_id)
+    return summarize_message(message, email_address) if message else None
+
 def analyze_status(email_content):
     """
     Uses LLM to determine the status based on the email content.
@@ -114,124 +115,133 @@ def analyze_sent_email(email_content):
         print(f"Error analyzing sent email: {e}")
         return "No Change"
 
+def get_leads_by_email():
+    """In-memory email -> lead map (lower-cased) for leads that exist in HubSpot."""
+    return {
+        lead['email'].lower(): lead
+        for lead in iter_leads("hubspot_id IS NOT NULL", columns="id, email, name, hubspot_id, metadata")
+    }
+
+def find_new_emails(service, leads_by_email):
+    """
+    Latest new message per lead since the stored Gmail historyId.
+    Returns (latest_by_email, history_id_to_store). Without a usable historyId, every lead
+    is searched once (the old way) and the mailbox's current historyId becomes the new start.
+    """
+    start_history_id = get_sync_state(HISTORY_STATE_KEY)
+    if start_history_id:
+        try:
+            message_ids, history_id = list_added_message_ids(service, start_history_id)
+            print(f"{len(message_ids)} new messages since historyId {start_history_id}.")
+            # Headers + snippet only, fetched in batches
+            messages = get_messages(service, message_ids, headers=METADATA_HEADERS)
+            return latest_messages_by_lead(messages.values(), leads_by_email), history_id
+        except HistoryExpired as e:
+            print(f"{e}; falling back to a full search.")
+
+    # Taken before the scan so mail arriving during it is picked up next cycle
+    history_id = get_current_history_id(service)
+    latest_ids = {}
+    for email, lead in leads_by_email.items():
+        print(f"Checking history for {lead['email']}...")
+        msg_id = find_latest_message_id(service, lead['email'])
+        if msg_id:
+            latest_ids[email] = msg_id
+    
+    messages = get_messages(service, latest_ids.values())
+    latest = {
+        email: summarize_message(messages[msg_id], email)
+        for email, msg_id in latest_ids.items() if msg_id in messages
+    }
+    return latest, history_id
+
+def process_latest_email(lead, latest_email, hubspot_updates):
+    email = lead['email']
+    hubspot_property = "hs_lead_status"
+    hubspot_value = None
+    new_status = "No Change"
+
+    if latest_email['is_from_lead']:
+        # THEY replied
+        print(f"  Found reply from lead: '{latest_email['content'][:50]}...'")
+        new_status = analyze_status(latest_email['content'])
+        print(f"  Analyzed Reply Status: {new_status}")
+    
+        # Notify Slack
+        from notifications.events import reply_detected
+        lead_info = {"name": lead.get('name') or 'Unknown', "email": email}
+        reply_detected(lead_info, new_status)
+    
+        # Update Local DB Metadata for Suppression
+        # Always mark as replied
+        patch = {'has_replied': True}
+    
+        if new_status == "Interested":
+            hubspot_value = "OPEN_DEAL"
+        elif new_status == "Meeting Booked":
+            hubspot_value = "CONNECTED"
+            patch['meeting_booked'] = True
+        elif new_status == "Not Interested":
+            hubspot_value = "UNQUALIFIED"
+        elif new_status == "Unsubscribe":
+            hubspot_value = "UNQUALIFIED"
+            patch['do_not_contact'] = True
+        elif new_status == "Wrong Person":
+            hubspot_value = "UNQUALIFIED"
+        elif new_status == "Ooo":
+            print("  Out of Office. No status change.")
+            return
+        else:
+            hubspot_value = "CONNECTED"
+
+        # Save metadata to DB
+        patch_lead_metadata(lead['id'], patch)
+
+    else:
+        # WE sent the last email (No reply yet)
+        print(f"  Last email was sent BY US: '{latest_email['content'][:50]}...'")
+        new_status = analyze_sent_email(latest_email['content'])
+        print(f"  Analyzed Sent Status: {new_status}")
+    
+        if new_status == "New":
+            hubspot_value = "NEW"
+        elif new_status == "Attempted to Contact":
+            hubspot_value = "ATTEMPTED_TO_CONTACT"
+        elif new_status == "Connected":
+            hubspot_value = "CONNECTED"
+
+    if hubspot_value:
+        # Values HubSpot already has from our last push are skipped by the buffer
+        print(f"  Updating HubSpot {hubspot_property} to {hubspot_value}...")
+        hubspot_updates.add(lead['hubspot_id'], hubspot_property, hubspot_value)
+    else:
+        print(f"  Status '{new_status}' does not map to a status change.")
+
 def main():
     print("--- Syncing Email History to HubSpot ---")
     
-    # 1. Get all contacts from HubSpot
-    contacts = get_all_contacts()
-    print(f"Found {len(contacts)} contacts in HubSpot.")
-    
-    # 2. Initialize Gmail Service
+    # 1. Initialize Gmail Service
     try:
         service = get_service()
     except Exception as e:
         print(f"Failed to connect to Gmail: {e}")
         sys.exit(1)
-        
-    for contact in contacts:
-        email = contact.properties.get('email')
-        if not email:
-            continue
-            
-        print(f"Checking history for {email}...")
-        
-        # 3. Get latest email
-        latest_email = get_latest_email_content(service, email)
-        
-        if not latest_email:
-            print("  No email history found.")
-            continue
-            
-        hubspot_property = "hs_lead_status"
-        hubspot_value = None
-        new_status = "No Change"
-
-        if latest_email['is_from_lead']:
-            # THEY replied
-            print(f"  Found reply from lead: '{latest_email['content'][:50]}...'")
-            new_status = analyze_status(latest_email['content'])
-            print(f"  Analyzed Reply Status: {new_status}")
-            
-            # Notify Slack
-            from notifications.events import reply_detected
-            # We need to pass a lead dict, but we only have contact object here.
-            # We can construct a minimal lead dict or fetch from DB.
-            # Since we fetch local_lead below, let's do it there or construct one.
-            lead_info = {"name": contact.properties.get('firstname', 'Unknown'), "email": email}
-            reply_detected(lead_info, new_status)
-            
-            # Update Local DB Metadata for Suppression
-            # Fetch current metadata to update it
-            # We need to get the lead from DB first.
-            # Since we iterate contacts from HubSpot, we need to find the local lead by email.
-            from db import get_lead_by_email, get_db_connection
-            import json
-            
-            local_lead = get_lead_by_email(email)
-            if local_lead:
-                metadata = local_lead.get('metadata', {})
-                if isinstance(metadata, str):
-                    try:
-                        metadata = json.loads(metadata)
-                    except:
-                        metadata = {}
-                
-                # Always mark as replied
-                metadata['has_replied'] = True
-                
-                if new_status == "Interested":
-                    hubspot_value = "OPEN_DEAL"
-                elif new_status == "Meeting Booked":
-                    hubspot_value = "CONNECTED"
-                    metadata['meeting_booked'] = True
-                elif new_status == "Not Interested":
-                    hubspot_value = "UNQUALIFIED"
-                elif new_status == "Unsubscribe":
-                    hubspot_value = "UNQUALIFIED"
-                    metadata['do_not_contact'] = True
-                elif new_status == "Wrong Person":
-                    hubspot_value = "UNQUALIFIED"
-                elif new_status == "Ooo":
-                    print("  Out of Office. No status change.")
-                    continue
-                else:
-                    hubspot_value = "CONNECTED"
-
-                # Save metadata to DB
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute("UPDATE leads SET metadata = ? WHERE id = ?", (json.dumps(metadata), local_lead['id']))
-                conn.commit()
-                conn.close()
-            else:
-                print(f"  Warning: Lead {email} not found locally. Skipping metadata update.")
-                # Still update HubSpot below
-                if new_status == "Interested": hubspot_value = "OPEN_DEAL"
-                elif new_status == "Meeting Booked": hubspot_value = "CONNECTED"
-                elif new_status == "Not Interested": hubspot_value = "UNQUALIFIED"
-                elif new_status == "Unsubscribe": hubspot_value = "UNQUALIFIED"
-                elif new_status == "Wrong Person": hubspot_value = "UNQUALIFIED"
-                else: hubspot_value = "CONNECTED"
+    
+    # 2. Only mail that arrived since the last run (Gmail history), matched to leads by address
+    leads_by_email = get_leads_by_email()
+    latest_by_email, history_id = find_new_emails(service, leads_by_email)
+    print(f"{len(latest_by_email)} of {len(leads_by_email)} leads have new email activity.")
+    
+    with ContactUpdateBuffer() as hubspot_updates:
+        for email, latest_email in latest_by_email.items():
+            lead = leads_by_email[email]
+            print(f"Processing new email for {lead['email']}...")
+            process_latest_email(lead, latest_email, hubspot_updates)
 
-        else:
-            # WE sent the last email (No reply yet)
-            print(f"  Last email was sent BY US: '{latest_email['content'][:50]}...'")
-            new_status = analyze_sent_email(latest_email['content'])
-            print(f"  Analyzed Sent Status: {new_status}")
-            
-            if new_status == "New":
-                hubspot_value = "NEW"
-            elif new_status == "Attempted to Contact":
-                hubspot_value = "ATTEMPTED_TO_CONTACT"
-            elif new_status == "Connected":
-                hubspot_value = "CONNECTED"
-
-        if hubspot_value:
-            # Only update if it's different (optional optimization, but good to just set it)
-            print(f"  Updating HubSpot {hubspot_property} to {hubspot_value}...")
-            update_contact_property(contact.id, hubspot_property, hubspot_value)
-        else:
-            print(f"  Status '{new_status}' does not map to a status change.")
+    print(f"HubSpot: {hubspot_updates.updated} contacts updated, {hubspot_updates.skipped} unchanged values skipped, {len(hubspot_updates.errors)} failed.")
+    
+    # Advance only after everything above was processed
+    set_sync_state(HISTORY_STATE_KEY, history_id)
 
 if __name__ == '__main__':
     main()
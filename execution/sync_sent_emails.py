@@ -1,156 +1,176 @@
 import os
-import json
 import datetime
+import time
 import sys
 
 # Add parent dir to path to import notifications
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from db import get_db_connection
+from db import iter_active_leads, patch_lead_metadata, get_sync_state, set_sync_state
 from send_email import get_service
-from hubspot_utils import update_contact_property
-from sync_crm import sync_event
+from gmail_batch import get_messages
+from gmail_history import latest_messages_by_lead
+from hubspot_utils import ContactUpdateBuffer
+from sync_crm import sync_event, flush_events
 from dotenv import load_dotenv
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
 
-def get_sent_messages(service, to_email):
-    """Get messages sent to a specific email."""
-    try:
-        query = f"to:{to_email} label:SENT"
-        results = service.users().messages().list(userId='me', q=query).execute()
-        messages = results.get('messages', [])
-        return messages
-    except Exception as e:
-        print(f"Error fetching sent messages: {e}")
-        return []
+# Time (epoch seconds) up to which the SENT label has been scanned
+SENT_WATERMARK_KEY = 'gmail_sent_watermark'
+# First run without a watermark: how far back to look
+SENT_SCAN_LOOKBACK_DAYS = int(os.getenv("SENT_SCAN_LOOKBACK_DAYS", "30"))
+# Re-scan a little before the watermark (Gmail's after: filter is coarse)
+SENT_SCAN_OVERLAP_SECONDS = 3600
 
-def get_message_details(service, msg_id):
-    try:
-        msg = service.users().messages().get(userId='me', id=msg_id).execute()
-        payload = msg['payload']
-        headers = payload.get('headers')
-        date_header = next(h['value'] for h in headers if h['name'] == 'Date')
-        # Parse date (simplified) - Gmail date format is complex, using a library or robust parsing is better
-        # For now, we rely on internalDate which is timestamp in ms
-        internal_date = int(msg['internalDate']) / 1000
-        return internal_date
-    except Exception as e:
-        print(f"Error fetching message details: {e}")
-        return 0
+def list_sent_message_ids(service, since_epoch):
+    """Ids of every message in SENT after since_epoch (all pages)."""
+    message_ids = []
+    page_token = None
+    while True:
+        results = service.users().messages().list(
+            userId='me', labelIds=['SENT'], q=f"after:{int(since_epoch)}",
+            maxResults=500, pageToken=page_token
+        ).execute()
+        message_ids.extend(m['id'] for m in results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return message_ids
+
+def get_latest_sent_times(service, pending_by_email, since_epoch):
+    """
+    One scan of the SENT label since since_epoch, bucketed by recipient.
+    Returns {email: newest send time (epoch seconds)} for the pending leads only.
+    """
+    message_ids = list_sent_message_ids(service, since_epoch)
+    print(f"{len(message_ids)} sent messages since {datetime.datetime.fromtimestamp(since_epoch)}.")
+    # Recipients + internalDate only, fetched in batched requests
+    messages = get_messages(service, message_ids, headers=['To', 'Cc', 'Date'])
+    latest = latest_messages_by_lead(messages.values(), pending_by_email)
+    return {email: info['internal_date'] / 1000 for email, info in latest.items()}
+
+def scan_start(pending_by_email):
+    watermark = get_sync_state(SENT_WATERMARK_KEY)
+    if watermark:
+        return float(watermark) - SENT_SCAN_OVERLAP_SECONDS
+    # No watermark yet: nothing before the oldest pending lead's last contact matters
+    contacted = [
+        datetime.datetime.fromisoformat(lead['metadata']['last_contacted_at']).timestamp()
+        for lead in pending_by_email.values() if lead['metadata'].get('last_contacted_at')
+    ]
+    lookback = time.time() - SENT_SCAN_LOOKBACK_DAYS * 86400
+    return min(contacted) if len(contacted) == len(pending_by_email) and contacted else lookback
 
 def main():
     print("--- Syncing Sent Emails ---")
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM leads WHERE status NOT IN ('disqualified', 'converted', 'unsubscribed')")
-    rows = cursor.fetchall()
-    
     service = get_service()
     
-    for row in rows:
-        lead = dict(row)
-        email = lead['email']
-        
-        if not lead.get('metadata'):
-            continue
-            
-        try:
-            metadata = json.loads(lead['metadata'])
-        except:
-            continue
-            
-        draft_stage = metadata.get('draft_created_for_stage')
-        
-        if not draft_stage:
-            continue
-            
-        print(f"Checking if draft for Stage {draft_stage} was sent to {email}...")
-        
-        # Check Sent folder
-        messages = get_sent_messages(service, email)
-        if not messages:
-            print("  No sent messages found.")
-            continue
+    scan_started = time.time()
+    
+    # 1. Leads with a pending draft, keyed by address (lower-cased)
+    pending_by_email = {}
+    # Streamed: the first lead is checked before the last one is read
+    for lead in iter_active_leads():
+        metadata = lead['metadata']
+        if metadata and metadata.get('draft_created_for_stage'):
+            pending_by_email[lead['email'].lower()] = lead
+    
+    print(f"{len(pending_by_email)} leads with a pending draft.")
+    
+    # 2. One scan of the SENT label since the watermark, matched against those leads
+    sent_times = {}
+    if pending_by_email:
+        sent_times = get_latest_sent_times(service, pending_by_email, scan_start(pending_by_email))
+    
+    with ContactUpdateBuffer() as hubspot_updates:
+        for key, lead in pending_by_email.items():
+            email = lead['email']
+            metadata = lead['metadata']
+            draft_stage = metadata.get('draft_created_for_stage')
             
-        # Get latest sent message time
-        latest_msg = messages[0]
-        sent_time = get_message_details(service, latest_msg['id'])
+            print(f"Checking if draft for Stage {draft_stage} was sent to {email}...")
+            sent_time = sent_times.get(key)
+            if not sent_time:
+                print("  No sent messages found.")
+                continue
         
-        # If sent recently (e.g., after the draft was created or simply check if it exists)
-        # A robust way is to check if sent_time > last_contacted_at (if it exists)
-        # But since we only create draft when due, any recent sent email likely corresponds to it.
-        # Let's assume if we find a sent email within the last 24 hours (or since draft creation), it's the one.
+            # If sent recently (e.g., after the draft was created or simply check if it exists)
+            # A robust way is to check if sent_time > last_contacted_at (if it exists)
+            # But since we only create draft when due, any recent sent email likely corresponds to it.
+            # Let's assume if we find a sent email within the last 24 hours (or since draft creation), it's the one.
         
-        # Simplified logic: If we have a 'draft_created_for_stage' and we see a sent email 
-        # that is NEWER than the previous 'last_contacted_at', then it's sent.
+            # Simplified logic: If we have a 'draft_created_for_stage' and we see a sent email 
+            # that is NEWER than the previous 'last_contacted_at', then it's sent.
         
-        # Safety Check: Detect ANY sent email since last contact
-        # If we find an email that is NOT the draft we expected (or even if it is),
-        # we treat it as a "Contact Event".
+            # Safety Check: Detect ANY sent email since last contact
+            # If we find an email that is NOT the draft we expected (or even if it is),
+            # we treat it as a "Contact Event".
         
-        last_contacted_str = metadata.get('last_contacted_at')
-        last_contacted_ts = 0
-        if last_contacted_str:
-            last_contacted_ts = datetime.datetime.fromisoformat(last_contacted_str).timestamp()
+            last_contacted_str = metadata.get('last_contacted_at')
+            last_contacted_ts = 0
+            if last_contacted_str:
+                last_contacted_ts = datetime.datetime.fromisoformat(last_contacted_str).timestamp()
             
-        if sent_time > last_contacted_ts:
-            print(f"  Found sent email! (Time: {datetime.datetime.fromtimestamp(sent_time)})")
+            if sent_time > last_contacted_ts:
+                print(f"  Found sent email! (Time: {datetime.datetime.fromtimestamp(sent_time)})")
             
-            # Logic:
-            # If we had a draft pending for Stage X, and we see a sent email, we assume Stage X is done.
-            # If we DIDN'T have a draft pending, but we see a sent email, it means the user sent something manually.
-            # In that case, we should probably just advance the 'last_contacted_at' so we don't send the next auto-email too soon.
+                # Logic:
+                # If we had a draft pending for Stage X, and we see a sent email, we assume Stage X is done.
+                # If we DIDN'T have a draft pending, but we see a sent email, it means the user sent something manually.
+                # In that case, we should probably just advance the 'last_contacted_at' so we don't send the next auto-email too soon.
             
-            new_stage = draft_stage if draft_stage else metadata.get('sequence_stage', 0)
+                new_stage = draft_stage if draft_stage else metadata.get('sequence_stage', 0)
             
-            # If it was a manual send unrelated to the draft, we might want to skip the current stage?
-            # For now, let's just update timestamp and clear the draft flag if it exists.
+                # If it was a manual send unrelated to the draft, we might want to skip the current stage?
+                # For now, let's just update timestamp and clear the draft flag if it exists.
             
-            metadata['last_contacted_at'] = datetime.datetime.fromtimestamp(sent_time).isoformat()
+                patch = {'last_contacted_at': datetime.datetime.fromtimestamp(sent_time).isoformat()}
             
-            if draft_stage:
-                print(f"  Matched pending draft for Stage {draft_stage}.")
-                metadata['sequence_stage'] = draft_stage
-                metadata.pop('draft_created_for_stage', None) # Clear flag
+                if draft_stage:
+                    print(f"  Matched pending draft for Stage {draft_stage}.")
+                    patch['sequence_stage'] = draft_stage
+                    patch['draft_created_for_stage'] = None # Clear flag
                 
-                # Update HubSpot Status for Stage Advance
-                hubspot_status = "ATTEMPTED_TO_CONTACT"
-                if draft_stage == 4:
-                    hubspot_status = "UNQUALIFIED"
+                    # Update HubSpot Status for Stage Advance
+                    hubspot_status = "ATTEMPTED_TO_CONTACT"
+                    if draft_stage == 4:
+                        hubspot_status = "UNQUALIFIED"
                 
-                if lead.get('hubspot_id'):
-                     print(f"  Updating HubSpot Status to {hubspot_status}...")
-                     update_contact_property(lead['hubspot_id'], "hs_lead_status", hubspot_status)
-            else:
-                print("  Detected manual email (no draft pending). Updating last_contacted_at.")
-                # Optional: Increment stage or just wait? 
-                # If user sent a manual email, maybe we consider that "Stage X" done?
-                # Let's just update timestamp. The next auto-email will be delayed by the cadence logic.
+                    if lead.get('hubspot_id'):
+                         print(f"  Updating HubSpot Status to {hubspot_status}...")
+                         hubspot_updates.add(lead['hubspot_id'], "hs_lead_status", hubspot_status)
+                else:
+                    print("  Detected manual email (no draft pending). Updating last_contacted_at.")
+                    # Optional: Increment stage or just wait? 
+                    # If user sent a manual email, maybe we consider that "Stage X" done?
+                    # Let's just update timestamp. The next auto-email will be delayed by the cadence logic.
             
-            # Update DB
-            cursor.execute("UPDATE leads SET metadata = ? WHERE id = ?", (json.dumps(metadata), lead['id']))
-            conn.commit()
+                # Update DB
+                patch_lead_metadata(lead['id'], patch)
             
-            # Sync to HubSpot
-            sync_event("Email Sent", {
-                "email": email,
-                "stage": new_stage,
-                "note": "Detected sent email (Manual or Draft)."
-            })
+                # Sync to HubSpot
+                sync_event("Email Sent", {
+                    "email": email,
+                    "stage": new_stage,
+                    "note": "Detected sent email (Manual or Draft)."
+                })
             
-            # Notify Slack
-            from notifications.events import email_sent, sequence_advanced
-            email_sent(lead, new_stage)
-            if draft_stage:
-                sequence_advanced(lead, new_stage)
+                # Notify Slack
+                from notifications.events import email_sent, sequence_advanced
+                email_sent(lead, new_stage)
+                if draft_stage:
+                    sequence_advanced(lead, new_stage)
                  
-            print("  Lead updated.")
-        else:
-            print("  No new sent email detected.")
-            
-    conn.close()
+                print("  Lead updated.")
+            else:
+                print("  No new sent email detected.")
+
+    print(f"HubSpot: {hubspot_updates.updated} contacts updated, {hubspot_updates.skipped} unchanged values skipped, {len(hubspot_updates.errors)} failed.")
+    flush_events()
+    
+    # Everything sent before this run started has been matched
+    set_sync_state(SENT_WATERMARK_KEY, scan_started)
 
 if __name__ == '__main__':
     main()
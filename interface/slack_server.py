@@ -11,6 +11,7 @@ from execution.db import get_db_connection, get_lead_by_email
 from execution.send_email import send_message, get_service
 from execution.hubspot_utils import update_contact_property
 from execution.sync_crm import sync_event
+from execution.hubspot_webhooks import verify_signature, webhook_queue
 from notifications.slack_notifier import notifier
 import datetime
 
@@ -329,6 +330,32 @@ Hi {{name}},
     # Update the original message
     requests.post(response_url, json={"replace_original": True, "blocks": blocks, "text": "Template Refined"})
 
+@app.route('/hubspot/webhook', methods=['POST'])
+def hubspot_webhook():
+    """
+    HubSpot contact creation / property change / deletion events.
+    Answered immediately; events are applied to the DB in batches by a background thread.
+    """
+    body = request.get_data(as_text=True)
+    # Behind a proxy (Railway/ngrok) HubSpot signed the public https URL
+    url = request.url
+    forwarded_proto = request.headers.get('X-Forwarded-Proto')
+    if forwarded_proto and url.startswith('http://') and forwarded_proto == 'https':
+        url = 'https://' + url[len('http://'):]
+
+    if not verify_signature(os.getenv("HUBSPOT_CLIENT_SECRET"), request.method, url, body, request.headers):
+        return "Invalid signature", 401
+
+    try:
+        events = json.loads(body)
+    except json.JSONDecodeError:
+        return "Invalid JSON", 400
+    if isinstance(events, dict):
+        events = [events]
+
+    webhook_queue.enqueue(events)
+    return "", 204
+
 @app.route('/', methods=['GET'])
 def health_check():
     return "Slack Control Center is Running", 200
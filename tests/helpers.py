@@ -0,0 +1,37 @@
+import unittest
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+# Add parent dir to path to import execution
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution import db
+
+
+class DBTestCase(unittest.TestCase):
+    """Runs each test against a fresh SQLite file."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original = (db.DB_PATH, db.DATABASE_URL)
+        db.DB_PATH = os.path.join(self.tmpdir.name, 'test.db')
+        db.DATABASE_URL = None
+        db.close_pool()
+        db.lead_cache.clear()
+        db.init_db()
+
+    def tearDown(self):
+        db.close_pool()
+        db.DB_PATH, db.DATABASE_URL = self.original
+        self.tmpdir.cleanup()
+
+
+def contact(contact_id, email=None, modified_ms=None, **properties):
+    """A HubSpot contact object as returned by the SDK (id, properties, updated_at)."""
+    if email is not None:
+        properties['email'] = email
+    if modified_ms is not None:
+        properties['lastmodifieddate'] = str(modified_ms)
+    return SimpleNamespace(id=str(contact_id), properties=properties, updated_at=None)
@@ -0,0 +1,365 @@
+import unittest
+import os
+import sys
+import threading
+import sqlite3
+from unittest.mock import patch
+from datetime import datetime, timedelta
+
+# Add parent dir to path to import execution
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution import db
+from helpers import DBTestCase
+
+
+class TestConnectionPool(DBTestCase):
+
+    def test_sqlite_connection_reused_per_thread(self):
+        conn_a = db.get_db_connection()
+        raw_a = conn_a._conn
+        conn_a.close()
+
+        conn_b = db.get_db_connection()
+        self.assertIs(conn_b._conn, raw_a)
+        conn_b.close()
+
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(db.get_pool().acquire()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(seen[0], raw_a)
+
+    def test_sqlite_pragmas_applied(self):
+        conn = db.get_db_connection()
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], db.SQLITE_PRAGMAS['busy_timeout'])
+        self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1) # NORMAL
+        conn.close()
+
+    def test_context_manager_rolls_back_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with db.db_connection() as conn:
+                db.execute_query(conn, "INSERT INTO leads (email) VALUES (?)", ("a@example.com",))
+                raise RuntimeError("boom")
+        self.assertIsNone(db.get_lead_by_email("a@example.com"))
+
+    def test_helpers_round_trip(self):
+        lead_id = db.add_lead({"email": "b@example.com", "name": "B", "metadata": {"company": "Acme"}})
+        self.assertIsNotNone(lead_id)
+        self.assertIsNone(db.add_lead({"email": "b@example.com"}))
+
+        db.update_lead_hubspot_id(lead_id, "hs-1")
+        lead = db.get_lead_by_email("b@example.com")
+        self.assertEqual(lead['hubspot_id'], "hs-1")
+        self.assertEqual(lead['metadata']['company'], "Acme")
+
+
+class TestBulkUpsert(DBTestCase):
+
+    def test_inserts_and_merges_metadata(self):
+        db.add_lead({"email": "old@example.com", "name": "Old", "metadata": {"sequence_stage": 2, "company": "A"}})
+
+        written = db.bulk_upsert_leads([
+            {"email": "new@example.com", "name": "New", "source": "HubSpot Import",
+             "hubspot_id": "1", "metadata": {"sequence_stage": 0}},
+            {"email": "old@example.com", "name": "Renamed", "hubspot_id": "2",
+             "metadata": {"company": "B"}},
+        ])
+        self.assertEqual(written, 2)
+
+        new = db.get_lead_by_email("new@example.com")
+        self.assertEqual(new['hubspot_id'], "1")
+        self.assertEqual(new['source'], "HubSpot Import")
+
+        old = db.get_lead_by_email("old@example.com")
+        self.assertEqual(old['name'], "Renamed")
+        self.assertEqual(old['hubspot_id'], "2")
+        self.assertEqual(old['metadata'], {"sequence_stage": 2, "company": "B"})
+
+    def test_invalid_existing_metadata_is_replaced(self):
+        with db.db_connection() as conn:
+            db.execute_query(conn, "INSERT INTO leads (email, metadata) VALUES (?, ?)", ("bad@example.com", "not json"))
+            conn.commit()
+
+        written = db.bulk_upsert_leads([
+            {"email": "bad@example.com", "metadata": {"company": "A"}},
+            {"email": "ok@example.com", "metadata": {"company": "B"}},
+        ])
+        self.assertEqual(written, 2)
+        self.assertEqual(db.get_lead_by_email("bad@example.com")['metadata'], {"company": "A"})
+        self.assertEqual(db.get_lead_by_email("ok@example.com")['metadata'], {"company": "B"})
+
+    def test_existing_hubspot_id_is_kept(self):
+        lead_id = db.add_lead({"email": "c@example.com"})
+        db.update_lead_hubspot_id(lead_id, "keep")
+        db.bulk_upsert_leads([{"email": "c@example.com", "hubspot_id": "other"}])
+        self.assertEqual(db.get_lead_by_email("c@example.com")['hubspot_id'], "keep")
+
+    def test_delete_leads_by_email(self):
+        db.bulk_upsert_leads([{"email": "d@example.com"}, {"email": "e@example.com"}])
+        db.delete_leads_by_email(["d@example.com"])
+        self.assertIsNone(db.get_lead_by_email("d@example.com"))
+        self.assertIsNotNone(db.get_lead_by_email("e@example.com"))
+
+
+class TestSequenceColumns(DBTestCase):
+
+    def _add(self, email, **metadata):
+        return db.add_lead({"email": email, "metadata": metadata})
+
+    def test_due_leads_follow_cadence_and_suppression(self):
+        now = datetime.now()
+        self._add("new@example.com", sequence_stage=0, interest="ai")
+        self._add("due@example.com", sequence_stage=1, last_contacted_at=(now - timedelta(days=3)).isoformat())
+        self._add("early@example.com", sequence_stage=1, last_contacted_at=(now - timedelta(days=1)).isoformat())
+        self._add("replied@example.com", sequence_stage=0, has_replied=True)
+        self._add("done@example.com", sequence_stage=4, last_contacted_at=(now - timedelta(days=30)).isoformat())
+
+        due = {lead['email']: lead for lead in db.get_due_leads(now)}
+        self.assertEqual(set(due), {"new@example.com", "due@example.com"})
+        self.assertEqual(due["new@example.com"]['interest'], "ai")
+        self.assertEqual(due["due@example.com"]['interest'], "general")
+
+    def test_next_due_at_tracks_contact_time(self):
+        contacted = datetime(2026, 1, 10, 9, 30)
+        lead_id = self._add("n@example.com", sequence_stage=0)
+        db.update_lead_metadata(lead_id, {"sequence_stage": 2, "last_contacted_at": contacted.isoformat()})
+
+        self.assertEqual(db.get_next_due_at(contacted), datetime(2026, 1, 14, 9, 30))
+        self.assertEqual(db.get_due_leads(datetime(2026, 1, 13)), [])
+        self.assertEqual(len(db.get_due_leads(datetime(2026, 1, 14, 10))), 1)
+
+    def test_update_lead_metadata_refreshes_columns(self):
+        lead_id = self._add("a@example.com", sequence_stage=0)
+        db.update_lead_metadata(lead_id, {"sequence_stage": 2, "meeting_booked": True})
+        lead = db.get_lead_by_email("a@example.com")
+        self.assertEqual(lead['sequence_stage'], 2)
+        self.assertTrue(lead['meeting_booked'])
+
+    def test_migration_backfills_existing_database(self):
+        legacy = os.path.join(self.tmpdir.name, 'legacy.db')
+        conn = sqlite3.connect(legacy)
+        conn.execute("CREATE TABLE leads (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE NOT NULL, "
+                     "name TEXT, phone TEXT, source TEXT, status TEXT DEFAULT 'new', hubspot_id TEXT, "
+                     "lead_score INTEGER, intent TEXT, metadata TEXT, created_at TIMESTAMP, updated_at TIMESTAMP)")
+        conn.execute("INSERT INTO leads (email, metadata) VALUES (?, ?)",
+                     ("x@example.com", '{"sequence_stage": 3, "do_not_contact": true}'))
+        conn.execute("INSERT INTO leads (email, metadata) VALUES (?, ?)", ("y@example.com", "not json"))
+        conn.commit()
+        conn.close()
+
+        db.DB_PATH = legacy
+        db.init_db()
+        x = db.get_lead_by_email("x@example.com")
+        self.assertEqual(x['sequence_stage'], 3)
+        self.assertTrue(x['do_not_contact'])
+        self.assertEqual(db.get_lead_by_email("y@example.com")['sequence_stage'], 0)
+
+    def test_fresh_database_needs_no_migration(self):
+        db.DB_PATH = os.path.join(self.tmpdir.name, 'fresh.db')
+        with patch('builtins.print') as mock_print:
+            db.init_db()
+        self.assertFalse(any("Migrated" in str(call) for call in mock_print.call_args_list))
+
+    def test_postgres_projection_tolerates_invalid_json(self):
+        sql = db._build_sequence_projection("", 'postgres')
+        self.assertIn("safe_jsonb(metadata)", sql)
+        self.assertNotIn("metadata::jsonb", sql)
+
+
+class TestLeadRecord(DBTestCase):
+
+    def test_metadata_is_decoded_lazily(self):
+        lead = db.Lead.from_row({"id": 1, "email": "l@example.com", "metadata": '{"company": "Acme"}'})
+        self.assertIsNone(lead._metadata)
+        self.assertIsNone(lead._dirty)
+        self.assertEqual(lead.get('metadata', {}).get('company'), "Acme")
+        self.assertEqual(dict(lead)['email'], "l@example.com")
+        self.assertNotIn('phone', lead)
+        self.assertEqual(db.Lead.from_row({"id": 2, "metadata": "not json"})['metadata'], {})
+
+    def test_save_lead_writes_only_changes(self):
+        db.add_lead({"email": "s@example.com", "name": "Old", "metadata": {"company": "Acme", "tmp": 1}})
+        lead = db.get_lead_by_email("s@example.com")
+        self.assertEqual(lead.changes(), ({}, {}))
+
+        lead['name'] = "New"
+        lead['metadata']['sequence_stage'] = 1
+        del lead['metadata']['tmp']
+        self.assertEqual(lead.changes(), ({'name': "New"}, {'sequence_stage': 1, 'tmp': None}))
+        with self.assertRaises(KeyError):
+            lead['sequence_stage'] = 2
+        with self.assertRaises(KeyError):
+            lead['id'] = 99
+
+        self.assertTrue(db.save_lead(lead))
+        self.assertFalse(db.save_lead(lead))
+        stored = db.get_lead_by_email("s@example.com")
+        self.assertEqual(stored['name'], "New")
+        self.assertEqual(stored['metadata'], {"company": "Acme", "sequence_stage": 1})
+        self.assertEqual(stored['sequence_stage'], 1)
+
+
+class TestLeadCache(DBTestCase):
+
+    def test_repeated_lookups_hit_cache(self):
+        lead_id = db.add_lead({"email": "c@example.com", "metadata": {"company": "Acme"}})
+        first = db.get_lead_by_email("c@example.com")
+        first['metadata']['company'] = "mutated by caller"
+
+        before = db.lead_cache.stats()
+        self.assertEqual(db.get_lead_by_email("c@example.com")['metadata']['company'], "Acme")
+        self.assertEqual(db.get_lead_by_id(lead_id)['email'], "c@example.com")
+        after = db.lead_cache.stats()
+        self.assertEqual(after['hits'] - before['hits'], 2)
+
+    def test_writes_invalidate(self):
+        lead_id = db.add_lead({"email": "w@example.com"})
+        db.get_lead_by_email("w@example.com")
+
+        db.patch_lead_metadata(lead_id, {"sequence_stage": 3})
+        self.assertEqual(db.get_lead_by_email("w@example.com")['sequence_stage'], 3)
+
+        db.update_lead_hubspot_id(lead_id, "hs-9")
+        self.assertEqual(db.get_lead_by_id(lead_id)['hubspot_id'], "hs-9")
+
+        db.delete_leads_by_email(["w@example.com"])
+        self.assertIsNone(db.get_lead_by_email("w@example.com"))
+
+    def test_entries_expire_and_are_bounded(self):
+        cache = db.LeadCache(maxsize=2, ttl=0)
+        cache.put({"id": 1, "email": "a", "metadata": {}}, cache.generation)
+        self.assertIsNone(cache.get(email="a"))
+
+        cache = db.LeadCache(maxsize=2, ttl=60)
+        for i in range(3):
+            cache.put({"id": i, "email": str(i), "metadata": {}}, cache.generation)
+        self.assertEqual(cache.stats()['size'], 2)
+        self.assertIsNone(cache.get(lead_id=0))
+
+        stale = cache.generation
+        cache.invalidate(emails=["1"])
+        cache.put({"id": 1, "email": "1", "metadata": {}}, stale)
+        self.assertIsNone(cache.get(email="1"))
+
+
+class TestArchive(DBTestCase):
+
+    def test_terminal_leads_move_to_archive(self):
+        done = db.add_lead({"email": "done@example.com", "metadata": {"sequence_stage": 4}})
+        db.add_lead({"email": "live@example.com"})
+        with db.db_connection() as conn:
+            db.execute_query(conn, "UPDATE leads SET status = 'converted' WHERE id = ?", (done,))
+            db.execute_query(conn, "INSERT INTO events (lead_id, event_type) VALUES (?, ?)", (done, "Email Sent"))
+        db.get_lead_by_email("done@example.com") # warm the cache
+
+        self.assertEqual(db.archive_terminal_leads(batch_size=1), 1)
+
+        self.assertEqual([lead['email'] for lead in db.iter_leads()], ["live@example.com"])
+        archived = db.get_lead_by_email("done@example.com")
+        self.assertEqual(archived['id'], done)
+        self.assertEqual(archived['sequence_stage'], 4)
+        self.assertIsNotNone(archived['archived_at'])
+        self.assertIsNone(db.get_lead_by_email("done@example.com", include_archived=False))
+        self.assertEqual(db.get_archived_emails(), {"done@example.com"})
+        self.assertEqual(db.get_archived_emails(["live@example.com", "done@example.com"]), {"done@example.com"})
+        with db.db_connection() as conn:
+            self.assertEqual(db.execute_query(conn, "SELECT COUNT(*) AS n FROM events").fetchone()['n'], 0)
+            self.assertEqual(db.execute_query(conn, "SELECT COUNT(*) AS n FROM events_archive").fetchone()['n'], 1)
+
+
+class TestSyncState(DBTestCase):
+
+    def test_watermark_round_trip(self):
+        self.assertIsNone(db.get_sync_state("hubspot_import_watermark"))
+        self.assertEqual(db.get_sync_state("hubspot_import_watermark", "0"), "0")
+        db.set_sync_state("hubspot_import_watermark", 1700000000000)
+        db.set_sync_state("hubspot_import_watermark", 1700000005000)
+        self.assertEqual(db.get_sync_state("hubspot_import_watermark"), "1700000005000")
+        db.set_sync_state("hubspot_import_watermark", None)
+        self.assertIsNone(db.get_sync_state("hubspot_import_watermark"))
+
+
+class TestPushedProperties(DBTestCase):
+
+    def test_last_pushed_values_round_trip(self):
+        db.record_pushed_properties([("101", {"hs_lead_status": "NEW"}), (102, {"hs_lead_status": "CONNECTED"})])
+        db.record_pushed_properties([("101", {"hs_lead_status": "ATTEMPTED_TO_CONTACT"})])
+        self.assertEqual(db.get_pushed_properties(["101", 102, "103"]), {
+            "101": {"hs_lead_status": "ATTEMPTED_TO_CONTACT"},
+            "102": {"hs_lead_status": "CONNECTED"},
+        })
+
+    def test_stale_values_are_ignored(self):
+        db.record_pushed_properties([("101", {"hs_lead_status": "NEW"})])
+        with db.db_connection() as conn:
+            db.execute_query(conn, "UPDATE hubspot_pushed_properties SET pushed_at = pushed_at - 7200")
+        self.assertEqual(db.get_pushed_properties(["101"], max_age=3600), {})
+        self.assertIn("101", db.get_pushed_properties(["101"]))
+
+
+class TestIndexes(DBTestCase):
+
+    def test_init_db_creates_managed_indexes(self):
+        self.assertEqual(db.index_report(), {'missing': [], 'unused': [], 'unmanaged': []})
+
+    def test_report_flags_missing_and_unmanaged(self):
+        with db.db_connection() as conn:
+            db.execute_query(conn, "DROP INDEX idx_leads_hubspot_id")
+            db.execute_query(conn, "CREATE INDEX idx_leads_phone ON leads (phone)")
+
+        report = db.index_report()
+        self.assertEqual(report['missing'], ['idx_leads_hubspot_id'])
+        self.assertEqual(report['unmanaged'], ['idx_leads_phone'])
+        self.assertIn('idx_leads_phone', report['unused'])
+
+        db.init_db() # idempotent, restores the managed set
+        self.assertEqual(db.index_report()['missing'], [])
+
+
+class TestPatchMetadata(DBTestCase):
+
+    def test_patch_merges_and_removes_keys(self):
+        lead_id = db.add_lead({"email": "p@example.com",
+                               "metadata": {"company": "Acme", "sequence_stage": 1, "draft_created_for_stage": 2}})
+        db.patch_lead_metadata(lead_id, {"sequence_stage": 2, "draft_created_for_stage": None})
+
+        lead = db.get_lead_by_email("p@example.com")
+        self.assertEqual(lead['metadata'], {"company": "Acme", "sequence_stage": 2})
+        self.assertEqual(lead['sequence_stage'], 2)
+
+    def test_patch_replaces_nested_values(self):
+        lead_id = db.add_lead({"email": "n@example.com", "metadata": {"drafts": {"a": 1, "b": 2}, "note": "x"}})
+        db.patch_lead_metadata(lead_id, {"drafts": {"a": 5, "c": None}, "tags": ["t"], "quote": 'say "hi"'})
+
+        self.assertEqual(db.get_lead_by_email("n@example.com")['metadata'], {
+            "drafts": {"a": 5, "c": None}, "note": "x", "tags": ["t"], "quote": 'say "hi"'
+        })
+
+    def test_patch_many_leads(self):
+        a = db.add_lead({"email": "a@example.com"})
+        b = db.add_lead({"email": "b@example.com", "metadata": {"x": 1}})
+        self.assertEqual(db.patch_leads_metadata({a: {"has_replied": True}, b: {"y": 2}}), 2)
+
+        self.assertTrue(db.get_lead_by_email("a@example.com")['has_replied'])
+        self.assertEqual(db.get_lead_by_email("b@example.com")['metadata'], {"x": 1, "y": 2})
+
+
+class TestStreaming(DBTestCase):
+
+    def test_iter_leads_pages_through_table(self):
+        db.bulk_upsert_leads([{"email": f"s{i}@example.com", "metadata": {"n": i}} for i in range(7)])
+        with db.db_connection() as conn:
+            db.execute_query(conn, "UPDATE leads SET status = 'converted' WHERE email = ?", ("s3@example.com",))
+
+        leads = list(db.iter_leads(batch_size=3))
+        self.assertEqual([lead['metadata']['n'] for lead in leads], list(range(7)))
+
+        active = [lead['email'] for lead in db.iter_active_leads(columns="id, email", batch_size=2)]
+        self.assertEqual(len(active), 6)
+        self.assertNotIn("s3@example.com", active)
+
+
+if __name__ == '__main__':
+    unittest.main()
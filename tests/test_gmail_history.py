@@ -0,0 +1,137 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import os
+import sys
+
+# Add parent dir to path to import execution
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution.gmail_history import (
+    HistoryExpired, list_added_message_ids, latest_messages_by_lead
+)
+from execution.gmail_batch import get_messages
+
+
+def message(msg_id, sender, to, internal_date, snippet=""):
+    return {
+        "id": msg_id,
+        "internalDate": str(internal_date),
+        "snippet": snippet,
+        "payload": {"headers": [
+            {"name": "From", "value": sender},
+            {"name": "To", "value": to},
+            {"name": "Date", "value": "Mon, 1 Jan 2024 10:00:00 +0000"},
+        ]},
+    }
+
+
+class HttpError404(Exception):
+    resp = MagicMock(status=404)
+
+
+class HttpError429(Exception):
+    resp = MagicMock(status=429)
+
+
+class FakeBatch:
+    """Stands in for BatchHttpRequest: runs the queued gets and reports through the callback."""
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request, request_id))
+
+    def execute(self):
+        self.service.batches.append([request_id for _, request_id in self.requests])
+        for request, request_id in self.requests:
+            try:
+                self.callback(request_id, request(), None)
+            except Exception as e:
+                self.callback(request_id, None, e)
+
+
+class FakeGmail:
+
+    def __init__(self, fail_once=()):
+        self.batches = []
+        self.calls = []
+        self.fail_once = set(fail_once)
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def get(self, **kwargs):
+        self.calls.append(kwargs)
+        def run():
+            if kwargs['id'] in self.fail_once:
+                self.fail_once.discard(kwargs['id'])
+                raise HttpError429()
+            return {"id": kwargs['id'], "internalDate": "1000"}
+        return run
+
+
+class TestHistoryList(unittest.TestCase):
+
+    def test_pages_are_followed_and_drafts_skipped(self):
+        service = MagicMock()
+        service.users().history().list().execute.side_effect = [
+            {"historyId": "110", "nextPageToken": "p2", "history": [
+                {"messagesAdded": [{"message": {"id": "a", "labelIds": ["INBOX"]}}]},
+                {"messagesAdded": [{"message": {"id": "d", "labelIds": ["DRAFT"]}}]},
+            ]},
+            {"historyId": "120", "history": [
+                {"messagesAdded": [{"message": {"id": "b", "labelIds": ["SENT"]}},
+                                   {"message": {"id": "a", "labelIds": ["INBOX"]}}]},
+            ]},
+        ]
+        self.assertEqual(list_added_message_ids(service, "100"), (["a", "b"], "120"))
+
+    def test_expired_history_raises(self):
+        service = MagicMock()
+        service.users().history().list().execute.side_effect = HttpError404()
+        with self.assertRaises(HistoryExpired):
+            list_added_message_ids(service, "1")
+
+
+class TestBatchFetch(unittest.TestCase):
+
+    @patch('execution.gmail_batch.time.sleep')
+    def test_messages_fetched_in_batches_with_retry(self, mock_sleep):
+        service = FakeGmail(fail_once={"m3"})
+        ids = [f"m{i}" for i in range(5)]
+        results = get_messages(service, ids + ["m0"], headers=['Date'], batch_size=2)
+        self.assertEqual(set(results), set(ids))
+        # 3 batches for 5 unique ids, then one retry batch for the rate-limited message
+        self.assertEqual(service.batches, [["m0", "m1"], ["m2", "m3"], ["m4"], ["m3"]])
+        self.assertEqual(service.calls[0]['format'], 'metadata')
+        self.assertEqual(service.calls[0]['metadataHeaders'], ['Date'])
+
+
+class TestMatching(unittest.TestCase):
+
+    def test_newest_message_per_lead(self):
+        leads = {"ann@example.com": {"id": 1}, "bob@example.com": {"id": 2}}
+        messages = [
+            message("1", "Me <me@agency.com>", "Ann <Ann@Example.com>", 1000, "intro"),
+            message("2", "Ann <ann@example.com>", "me@agency.com", 2000, "sounds good"),
+            message("3", "me@agency.com", "bob@example.com, stranger@example.com", 1500, "follow up"),
+            message("4", "stranger@example.com", "me@agency.com", 3000, "spam"),
+        ]
+        latest = latest_messages_by_lead(messages, leads)
+        self.assertEqual(set(latest), {"ann@example.com", "bob@example.com"})
+        self.assertTrue(latest["ann@example.com"]["is_from_lead"])
+        self.assertEqual(latest["ann@example.com"]["content"], "sounds good")
+        self.assertFalse(latest["bob@example.com"]["is_from_lead"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import os
+import sys
+import datetime
+from types import SimpleNamespace
+
+# Add parent dir to path to import execution
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution import db
+from execution.hubspot_utils import (
+    iter_modified_contact_pages, contact_modified_ms, ContactUpdateBuffer, NoteBuffer
+)
+from helpers import DBTestCase, contact
+
+
+class ApiError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+def page(results, after=None):
+    paging = SimpleNamespace(next=SimpleNamespace(after=after)) if after else None
+    return SimpleNamespace(results=results, paging=paging)
+
+
+class HubSpotTestCase(DBTestCase):
+    """Runs each test against a mocked HubSpot client (and a fresh SQLite file)."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = MagicMock()
+        patcher = patch('execution.hubspot_utils.get_hubspot_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestModifiedContactSearch(HubSpotTestCase):
+
+    def search_requests(self):
+        return [call.kwargs['public_object_search_request']
+                for call in self.client.crm.contacts.search_api.do_search.call_args_list]
+
+    @patch('execution.hubspot_utils.SEARCH_RESULT_CAP', 4)
+    def test_search_restarts_from_newest_timestamp_at_result_cap(self):
+        self.client.crm.contacts.search_api.do_search.side_effect = [
+            page([contact(1, modified_ms=150), contact(2, modified_ms=200)], after="2"),
+            page([contact(3, modified_ms=250), contact(4, modified_ms=300)], after="4"),
+            page([contact(5, modified_ms=350)]),
+        ]
+        pages = list(iter_modified_contact_pages(100, page_size=2))
+
+        self.assertEqual([[c.id for c in p] for p in pages], [["1", "2"], ["3", "4"], ["5"]])
+        requests = self.search_requests()
+        self.assertEqual([r.after for r in requests], [0, 2, 0])
+        # The restarted query filters from just before the last timestamp seen
+        self.assertEqual(requests[2].filter_groups[0]["filters"][0]["value"], "299")
+
+    @patch('execution.hubspot_utils.SEARCH_RESULT_CAP', 4)
+    def test_search_stops_when_cap_is_full_of_one_timestamp(self):
+        self.client.crm.contacts.search_api.do_search.side_effect = [
+            page([contact(1, modified_ms=100), contact(2, modified_ms=100)], after="2"),
+            page([contact(3, modified_ms=100), contact(4, modified_ms=100)], after="4"),
+        ]
+        pages = list(iter_modified_contact_pages(100, page_size=2))
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(self.client.crm.contacts.search_api.do_search.call_count, 2)
+
+    def test_search_errors_are_raised(self):
+        self.client.crm.contacts.search_api.do_search.side_effect = RuntimeError("HTTP 500")
+        with self.assertRaises(RuntimeError):
+            list(iter_modified_contact_pages(0))
+
+
+class TestContactUpdateBuffer(HubSpotTestCase):
+
+    def batch_inputs(self):
+        return [
+            [(i.id, i.properties) for i in call.kwargs['batch_input_simple_public_object_batch_input'].inputs]
+            for call in self.client.crm.contacts.batch_api.update.call_args_list
+        ]
+
+    def test_updates_are_merged_and_sent_in_batches(self):
+        self.client.crm.contacts.batch_api.update.return_value = SimpleNamespace(results=[], errors=[])
+        updates = ContactUpdateBuffer(batch_size=2)
+        updates.add("1", "hs_lead_status", "NEW")
+        updates.add("1", "hs_lead_status", "ATTEMPTED_TO_CONTACT")
+        updates.add("2", "hs_lead_status", "ATTEMPTED_TO_CONTACT") # fills the batch
+        updates.add("3", "hs_lead_status", "UNQUALIFIED")
+        updates.flush()
+
+        self.assertEqual(self.batch_inputs(), [
+            [("1", {"hs_lead_status": "ATTEMPTED_TO_CONTACT"}), ("2", {"hs_lead_status": "ATTEMPTED_TO_CONTACT"})],
+            [("3", {"hs_lead_status": "UNQUALIFIED"})],
+        ])
+        self.assertEqual((updates.updated, updates.errors), (3, {}))
+
+    def test_item_errors_are_mapped_to_their_contacts(self):
+        error = SimpleNamespace(message="Object not found", context={'ids': ['2']})
+        self.client.crm.contacts.batch_api.update.return_value = SimpleNamespace(results=[], errors=[error])
+        with ContactUpdateBuffer() as updates:
+            updates.add("1", "hs_lead_status", "NEW")
+            updates.add("2", "hs_lead_status", "NEW")
+
+        self.assertEqual(updates.updated, 1)
+        self.assertEqual(updates.errors, {"2": "Object not found"})
+        # Only the accepted update is remembered as pushed
+        self.assertEqual(set(db.get_pushed_properties(["1", "2"], max_age=3600)), {"1"})
+
+    def test_error_without_ids_falls_back_to_individual_updates(self):
+        error = SimpleNamespace(message="INVALID_OPTION", context=None)
+        self.client.crm.contacts.batch_api.update.return_value = SimpleNamespace(results=[], errors=[error])
+        self.client.crm.contacts.basic_api.update.side_effect = ApiError(400)
+        with ContactUpdateBuffer() as updates:
+            updates.add("1", "hs_lead_status", "BOGUS")
+
+        self.assertEqual(updates.updated, 0)
+        self.assertEqual(list(updates.errors), ["1"])
+        # The rejected value must not be remembered as pushed
+        self.assertEqual(db.get_pushed_properties(["1"], max_age=3600), {})
+
+    def test_rejected_batch_falls_back_to_individual_updates(self):
+        self.client.crm.contacts.batch_api.update.side_effect = RuntimeError("HTTP 400")
+        self.client.crm.contacts.basic_api.update.side_effect = [None, RuntimeError("HTTP 404")]
+        with ContactUpdateBuffer() as updates:
+            updates.add("1", "hs_lead_status", "NEW")
+            updates.add("2", "hs_lead_status", "NEW")
+
+        calls = self.client.crm.contacts.basic_api.update.call_args_list
+        self.assertEqual([call.kwargs['contact_id'] for call in calls], ["1", "2"])
+        self.assertEqual(updates.updated, 1)
+        self.assertEqual(list(updates.errors), ["2"])
+
+
+class TestNoteBuffer(HubSpotTestCase):
+
+    def test_events_for_one_contact_become_one_note(self):
+        self.client.crm.objects.notes.batch_api.create.return_value = SimpleNamespace(results=[1, 2], errors=[])
+        notes = NoteBuffer()
+        notes.add("1", "Email sent", datetime.datetime(2024, 1, 1, 9))
+        notes.add("2", "Reply received")
+        notes.add("1", "Meeting booked", datetime.datetime(2024, 1, 1, 10))
+        self.assertEqual(notes.flush(), 2)
+
+        batch = self.client.crm.objects.notes.batch_api.create.call_args.kwargs[
+            'batch_input_simple_public_object_input_for_create']
+        first = batch.inputs[0]
+        self.assertEqual(len(batch.inputs), 2)
+        self.assertEqual(first.associations[0]["to"]["id"], "1")
+        self.assertEqual(first.properties["hs_note_body"], "Email sent" + NoteBuffer.separator + "Meeting booked")
+        # The combined note carries the latest event's timestamp
+        self.assertEqual(first.properties["hs_timestamp"],
+                         str(int(datetime.datetime(2024, 1, 1, 10).timestamp() * 1000)))
+
+    def test_rejected_batch_falls_back_to_individual_creates(self):
+        self.client.crm.objects.notes.batch_api.create.side_effect = ApiError(400)
+        self.client.crm.objects.notes.basic_api.create.side_effect = [None, ApiError(404)]
+        notes = NoteBuffer()
+        notes.add("1", "Email sent")
+        notes.add("2", "Email sent")
+
+        self.assertEqual(notes.flush(), 1)
+        self.assertEqual(self.client.crm.objects.notes.basic_api.create.call_count, 2)
+        self.assertEqual(list(notes.errors), ["2"])
+        self.assertEqual(len(notes), 0)
+
+    def test_server_error_is_not_retried_individually(self):
+        # The batch may have been applied before the 5xx: re-creating would duplicate notes
+        self.client.crm.objects.notes.batch_api.create.side_effect = ApiError(502)
+        notes = NoteBuffer()
+        notes.add("1", "Email sent")
+        notes.add("2", "Email sent")
+
+        self.assertEqual(notes.flush(), 0)
+        self.client.crm.objects.notes.basic_api.create.assert_not_called()
+        self.assertEqual(sorted(notes.errors), ["1", "2"])
+
+
+class TestContactModifiedMs(unittest.TestCase):
+
+    def test_epoch_and_iso_values(self):
+        self.assertEqual(contact_modified_ms(contact(1, modified_ms=1700000000000)), 1700000000000)
+        iso = SimpleNamespace(properties={'lastmodifieddate': '2024-01-01T00:00:00Z'})
+        self.assertEqual(contact_modified_ms(iso), 1704067200000)
+
+    def test_falls_back_to_updated_at(self):
+        updated = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        self.assertEqual(contact_modified_ms(SimpleNamespace(properties={}, updated_at=updated)), 1704067200000)
+        self.assertIsNone(contact_modified_ms(SimpleNamespace(properties=None, updated_at=None)))
+
+
+if __name__ == '__main__':
+    unittest.main()
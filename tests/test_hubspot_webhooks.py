@@ -0,0 +1,113 @@
+import unittest
+import os
+import sys
+import hmac
+import base64
+import hashlib
+from unittest.mock import patch
+
+# Add parent dir to path to import execution
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution import db
+from execution.hubspot_webhooks import verify_signature, WebhookEventQueue, apply_events
+from helpers import DBTestCase, contact
+
+SECRET = "app-secret"
+URL = "https://example.com/hubspot/webhook"
+BODY = '[{"objectId": 101, "subscriptionType": "contact.creation"}]'
+
+
+def sign_v3(timestamp, body=BODY):
+    message = f"POST{URL}{body}{timestamp}".encode()
+    return base64.b64encode(hmac.new(SECRET.encode(), message, hashlib.sha256).digest()).decode()
+
+
+class TestSignature(unittest.TestCase):
+
+    def test_v3_signature(self):
+        now = 1700000000000
+        headers = {'X-HubSpot-Signature-v3': sign_v3(now), 'X-HubSpot-Request-Timestamp': str(now)}
+        self.assertTrue(verify_signature(SECRET, "POST", URL, BODY, headers, now_ms=now + 1000))
+        # Tampered body, wrong secret, stale timestamp
+        self.assertFalse(verify_signature(SECRET, "POST", URL, BODY + " ", headers, now_ms=now))
+        self.assertFalse(verify_signature("other", "POST", URL, BODY, headers, now_ms=now))
+        self.assertFalse(verify_signature(SECRET, "POST", URL, BODY, headers, now_ms=now + 10 * 60 * 1000))
+
+    def test_v2_signature(self):
+        signature = hashlib.sha256(f"{SECRET}POST{URL}{BODY}".encode()).hexdigest()
+        headers = {'X-HubSpot-Signature': signature, 'X-HubSpot-Signature-Version': 'v2'}
+        self.assertTrue(verify_signature(SECRET, "POST", URL, BODY, headers))
+        self.assertFalse(verify_signature(SECRET, "POST", URL + "?x=1", BODY, headers))
+
+    def test_missing_secret_or_signature_rejected(self):
+        self.assertFalse(verify_signature(None, "POST", URL, BODY, {'X-HubSpot-Signature-v3': 'x'}))
+        self.assertFalse(verify_signature(SECRET, "POST", URL, BODY, {}))
+
+
+class TestWebhookQueue(unittest.TestCase):
+
+    def test_events_are_batched(self):
+        events_queue = WebhookEventQueue(apply=lambda batch: None, batch_size=3, flush_seconds=0.05)
+        for i in range(5):
+            events_queue._queue.put({"objectId": i})
+        self.assertEqual([e["objectId"] for e in events_queue.next_batch(timeout=1)], [0, 1, 2])
+        self.assertEqual([e["objectId"] for e in events_queue.next_batch(timeout=1)], [3, 4])
+        self.assertEqual(events_queue.next_batch(timeout=0.01), [])
+
+
+def event(kind, object_id, occurred_at=0, **fields):
+    return {"subscriptionType": kind, "objectId": object_id, "occurredAt": occurred_at, **fields}
+
+
+@patch('execution.import_leads.notify_new_leads')
+class TestApplyEvents(DBTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch('execution.hubspot_utils.get_contacts_by_ids', return_value=[])
+        self.get_contacts = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_created_contact_is_imported(self, mock_notify):
+        self.get_contacts.return_value = [contact(101, "new@example.com", firstname="Ann")]
+        self.assertEqual(apply_events([event("contact.creation", 101)]), (1, 0, 0))
+
+        self.get_contacts.assert_called_once_with(["101"])
+        lead = db.get_lead_by_email("new@example.com")
+        self.assertEqual((lead['hubspot_id'], lead['name']), ("101", "Ann"))
+
+    def test_unwatched_property_changes_are_ignored(self, mock_notify):
+        apply_events([event("contact.propertyChange", 101, propertyName="hs_lead_status")])
+        self.get_contacts.assert_not_called()
+
+    def test_merge_removes_merged_away_contacts(self, mock_notify):
+        db.bulk_upsert_leads([
+            {"email": "primary@example.com", "hubspot_id": "201"},
+            {"email": "merged@example.com", "hubspot_id": "202"},
+        ])
+        self.get_contacts.return_value = [contact(201, "primary@example.com")]
+        new, _, deleted = apply_events([
+            event("contact.merge", 201, primaryObjectId=201, mergedObjectIds=[201, 202])
+        ])
+
+        self.get_contacts.assert_called_once_with(["201"])
+        self.assertEqual((new, deleted), (0, 1))
+        self.assertIsNotNone(db.get_lead_by_email("primary@example.com"))
+        self.assertIsNone(db.get_lead_by_email("merged@example.com"))
+
+    def test_latest_event_per_contact_wins(self, mock_notify):
+        db.bulk_upsert_leads([{"email": "gone@example.com", "hubspot_id": "301"}])
+        # Delivered out of order: the deletion happened after the property change
+        result = apply_events([
+            event("contact.deletion", 301, occurred_at=2),
+            event("contact.propertyChange", 301, occurred_at=1, propertyName="email"),
+        ])
+
+        self.assertEqual(result, (0, 0, 1))
+        self.get_contacts.assert_not_called()
+        self.assertIsNone(db.get_lead_by_email("gone@example.com"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import time
+
+# Add parent dir to path to import execution
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution import db
+from execution import import_leads
+from execution.import_leads import WATERMARK_KEY, FULL_SYNC_KEY
+from helpers import DBTestCase, contact
+
+
+def pages_then_error(*pages):
+    """Stands in for a HubSpot page iterator that fails after the given pages."""
+    def iterate(*args, **kwargs):
+        yield from pages
+        raise RuntimeError("HTTP 502")
+    return iterate
+
+
+@patch('execution.import_leads.notify_new_leads')
+class TestIncrementalImport(DBTestCase):
+
+    def test_watermark_advances_per_page_and_never_moves_back(self, mock_notify):
+        db.set_sync_state(WATERMARK_KEY, 10_000_000)
+        pages = [
+            [contact(1, "a@example.com", 10_000_500)],
+            # Re-read from the overlap window: older than the watermark
+            [contact(2, "b@example.com", 9_999_900)],
+        ]
+        with patch('execution.import_leads.iter_modified_contact_pages',
+                   side_effect=pages_then_error(*pages)) as mock_search:
+            import_leads.incremental_import()
+
+        mock_search.assert_called_once_with(10_000_000 - import_leads.WATERMARK_OVERLAP_MS)
+        # The failure after the second page keeps the progress made so far
+        self.assertEqual(db.get_sync_state(WATERMARK_KEY), "10000500")
+        self.assertIsNotNone(db.get_lead_by_email("a@example.com"))
+        self.assertIsNotNone(db.get_lead_by_email("b@example.com"))
+
+
+@patch('execution.import_leads.notify_new_leads')
+class TestFullImport(DBTestCase):
+
+    def setUp(self):
+        super().setUp()
+        db.add_lead({"email": "kept@example.com", "metadata": {}})
+        db.add_lead({"email": "gone@example.com", "metadata": {}})
+
+    def test_partial_fetch_skips_deletions(self, mock_notify):
+        with patch('execution.import_leads.iter_contact_pages',
+                   side_effect=pages_then_error([contact(1, "kept@example.com")])):
+            import_leads.full_import()
+
+        self.assertIsNotNone(db.get_lead_by_email("gone@example.com"))
+        self.assertIsNone(db.get_sync_state(WATERMARK_KEY))
+        self.assertIsNone(db.get_sync_state(FULL_SYNC_KEY))
+
+    def test_complete_fetch_deletes_and_sets_watermark(self, mock_notify):
+        with patch('execution.import_leads.iter_contact_pages',
+                   return_value=iter([[contact(1, "kept@example.com")]])):
+            import_leads.full_import()
+
+        self.assertIsNone(db.get_lead_by_email("gone@example.com"))
+        self.assertIsNotNone(db.get_lead_by_email("kept@example.com"))
+        self.assertIsNotNone(db.get_sync_state(WATERMARK_KEY))
+
+
+class TestFullSyncSchedule(DBTestCase):
+
+    def test_full_sync_without_watermark_or_when_overdue(self):
+        self.assertTrue(import_leads.needs_full_sync())
+
+        db.set_sync_state(WATERMARK_KEY, 1)
+        db.set_sync_state(FULL_SYNC_KEY, time.time())
+        self.assertFalse(import_leads.needs_full_sync())
+
+        db.set_sync_state(FULL_SYNC_KEY, time.time() - import_leads.FULL_SYNC_INTERVAL - 1)
+        self.assertTrue(import_leads.needs_full_sync())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import os
+import sys
+
+# Add parent dir to path to import execution
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution import db
+from execution import rate_limiter
+from execution.rate_limiter import TokenBucket, ThrottleStats, call_with_retry
+from helpers import DBTestCase
+
+
+class ApiError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.headers = headers or {}
+
+
+class TestRateLimiter(DBTestCase):
+
+    def test_bucket_allows_burst_then_paces(self):
+        now = 1000.0
+        waits = [db.reserve_rate_limit_token("test", rate=2, capacity=2, now=now) for _ in range(4)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 0.5)
+        self.assertAlmostEqual(waits[3], 1.0)
+        # Refilled after enough time has passed
+        self.assertEqual(db.reserve_rate_limit_token("test", rate=2, capacity=2, now=now + 10), 0.0)
+
+    def test_bucket_keeps_window_under_limit(self):
+        bucket = TokenBucket("hubspot_10s", limit=100, window=10)
+        self.assertAlmostEqual(bucket.capacity + bucket.rate * 10, 100)
+
+    @patch('execution.rate_limiter.time.sleep')
+    def test_retry_after_is_honoured(self, mock_sleep):
+        func = MagicMock(side_effect=[ApiError(429, {'Retry-After': '3'}), "ok"])
+        stats = ThrottleStats()
+        self.assertEqual(call_with_retry(func, 1, stats=stats), "ok")
+        self.assertEqual(func.call_count, 2)
+        delay = mock_sleep.call_args[0][0]
+        self.assertGreaterEqual(delay, 3)
+        self.assertLessEqual(delay, 3 + rate_limiter.BACKOFF_BASE)
+        self.assertEqual(stats.retries, 1)
+        self.assertGreaterEqual(stats.throttle_seconds, 3)
+
+    @patch('execution.rate_limiter.time.sleep')
+    def test_client_errors_are_not_retried(self, mock_sleep):
+        func = MagicMock(side_effect=ApiError(400))
+        with self.assertRaises(ApiError):
+            call_with_retry(func)
+        self.assertEqual(func.call_count, 1)
+        mock_sleep.assert_not_called()
+
+    @patch('execution.rate_limiter.time.sleep')
+    def test_non_idempotent_calls_retry_only_when_throttled(self, mock_sleep):
+        func = MagicMock(side_effect=[ApiError(429), ApiError(503), "created"])
+        with self.assertRaises(ApiError):
+            call_with_retry(func, retry_statuses=rate_limiter.THROTTLED_STATUSES)
+        self.assertEqual(func.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import os
+import sys
+import threading
+
+# Add parent dir to path to import execution
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution import db
+from execution.send_pipeline import BatchingStage, MailboxLimiter, run_send_pipeline
+from helpers import DBTestCase
+
+
+class TestDailyQuota(DBTestCase):
+
+    def test_quota_stops_at_limit_per_day(self):
+        used = [db.consume_daily_quota("gmail_send:me", 2, day="2024-01-01") for _ in range(3)]
+        self.assertEqual(used, [True, True, False])
+        self.assertTrue(db.consume_daily_quota("gmail_send:me", 2, day="2024-01-02"))
+
+
+class TestBatchingStage(unittest.TestCase):
+
+    def test_items_flushed_in_batches_and_drained_on_close(self):
+        batches = []
+        stage = BatchingStage("test", batches.append, batch_size=3, flush_seconds=60)
+        for i in range(7):
+            stage.put(i)
+        stage.close()
+        self.assertEqual(batches, [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(stage.processed, 7)
+
+
+class TestSendPipeline(DBTestCase):
+
+    def quota_used(self, limiter):
+        with db.db_connection() as conn:
+            row = db.execute_query(
+                conn, "SELECT SUM(used) AS used FROM daily_quotas WHERE name = ?", (limiter.quota_name,)
+            ).fetchone()
+        return row['used'] or 0
+
+    def test_sends_concurrently_until_quota_is_used(self):
+        sent = []
+        lock = threading.Lock()
+
+        def send_one(item):
+            with lock:
+                sent.append(item)
+            return True
+
+        limiter = MailboxLimiter("me@example.com", per_second=1000, daily_limit=4)
+        stats = run_send_pipeline(["a", "b", "c", "d", "e", "f"], send_one, limiter, workers=3)
+
+        self.assertEqual(len(sent), 4)
+        self.assertEqual((stats.sent, stats.failed, stats.skipped), (4, 0, 2))
+        self.assertEqual(self.quota_used(limiter), 4)
+        self.assertIn("emails/s", stats.summary(limiter))
+
+    def test_failed_sends_give_back_their_quota(self):
+        def send_one(item):
+            if item == "error":
+                raise RuntimeError("boom")
+            return item != "bad"
+
+        limiter = MailboxLimiter("me@example.com", per_second=1000, daily_limit=3)
+        stats = run_send_pipeline(["a", "bad", "error", "b", "c", "d"], send_one, limiter, workers=1)
+
+        self.assertEqual((stats.sent, stats.failed, stats.skipped), (3, 2, 1))
+        self.assertEqual(self.quota_used(limiter), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
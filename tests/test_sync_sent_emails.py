@@ -0,0 +1,82 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import os
+import sys
+import datetime
+
+# Add parent dir (and execution/, which the sync scripts import from) to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'execution'))
+
+from execution import sync_sent_emails
+
+
+def sent(msg_id, to, internal_date, cc=""):
+    headers = [{"name": "From", "value": "me@agency.com"}, {"name": "To", "value": to}]
+    if cc:
+        headers.append({"name": "Cc", "value": cc})
+    return {"id": msg_id, "internalDate": str(internal_date), "payload": {"headers": headers}}
+
+
+def lead(email, last_contacted_at=None):
+    metadata = {"draft_created_for_stage": 1}
+    if last_contacted_at:
+        metadata["last_contacted_at"] = last_contacted_at.isoformat()
+    return {"id": 1, "email": email, "metadata": metadata}
+
+
+class TestSentScan(unittest.TestCase):
+
+    def test_sent_messages_are_bucketed_by_recipient(self):
+        service = MagicMock()
+        service.users().messages().list().execute.side_effect = [
+            {"messages": [{"id": "1"}, {"id": "2"}], "nextPageToken": "p2"},
+            {"messages": [{"id": "3"}, {"id": "4"}]},
+        ]
+        messages = {
+            "1": sent("1", "Ann <Ann@Example.com>", 1000),
+            "2": sent("2", "ann@example.com", 3000),
+            "3": sent("3", "someone@example.com", 2000, cc="bob@example.com"),
+            "4": sent("4", "stranger@example.com", 4000),
+        }
+        pending = {"ann@example.com": lead("ann@example.com"), "bob@example.com": lead("bob@example.com")}
+
+        with patch.object(sync_sent_emails, 'get_messages', return_value=messages) as mock_get:
+            latest = sync_sent_emails.get_latest_sent_times(service, pending, 100)
+
+        self.assertEqual(latest, {"ann@example.com": 3.0, "bob@example.com": 2.0})
+        self.assertEqual(mock_get.call_args[0][1], ["1", "2", "3", "4"])
+        list_kwargs = service.users().messages().list.call_args_list
+        self.assertEqual(list_kwargs[-1].kwargs['q'], "after:100")
+        self.assertEqual(list_kwargs[-1].kwargs['pageToken'], "p2")
+
+
+class TestScanStart(unittest.TestCase):
+
+    def test_starts_just_before_the_watermark(self):
+        with patch.object(sync_sent_emails, 'get_sync_state', return_value="50000"):
+            start = sync_sent_emails.scan_start({"a@example.com": lead("a@example.com")})
+        self.assertEqual(start, 50000 - sync_sent_emails.SENT_SCAN_OVERLAP_SECONDS)
+
+    def test_first_run_starts_at_oldest_last_contact(self):
+        older = datetime.datetime(2024, 1, 1, 9)
+        pending = {
+            "a@example.com": lead("a@example.com", older),
+            "b@example.com": lead("b@example.com", datetime.datetime(2024, 1, 5)),
+        }
+        with patch.object(sync_sent_emails, 'get_sync_state', return_value=None):
+            self.assertEqual(sync_sent_emails.scan_start(pending), older.timestamp())
+
+    def test_first_run_falls_back_to_lookback_window(self):
+        pending = {
+            "a@example.com": lead("a@example.com", datetime.datetime(2024, 1, 1)),
+            "b@example.com": lead("b@example.com"), # never contacted
+        }
+        with patch.object(sync_sent_emails, 'get_sync_state', return_value=None), \
+                patch.object(sync_sent_emails.time, 'time', return_value=10_000_000):
+            start = sync_sent_emails.scan_start(pending)
+        self.assertEqual(start, 10_000_000 - sync_sent_emails.SENT_SCAN_LOOKBACK_DAYS * 86400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,27 +8,18 @@ from openai import OpenAI
 # Add parent dir
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from execution.db import get_db_connection
+from execution.db import db_connection, execute_query, Lead
 from execution.send_email import get_service, create_draft
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '../.env'))
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 def get_test_lead():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    # Get a lead that hasn't been contacted yet
-    cursor.execute("SELECT * FROM leads WHERE status='new' LIMIT 1")
-    row = cursor.fetchone()
-    conn.close()
+    with db_connection() as conn:
+        # Get a lead that hasn't been contacted yet
+        row = execute_query(conn, "SELECT * FROM leads WHERE status='new' LIMIT 1").fetchone()
     if row:
-        lead = dict(row)
-        if lead.get('metadata') and isinstance(lead['metadata'], str):
-            try:
-                lead['metadata'] = json.loads(lead['metadata'])
-            except:
-                lead['metadata'] = {}
-        return lead
+        return Lead.from_row(row)
     return None
 
 from execution.google_docs_utils import get_document_text